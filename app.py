@@ -1,16 +1,34 @@
 # Student Face Registration System
 # Main application file: app.py
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, g
 import cv2
 import numpy as np
 import os
 import base64
+import io
 import sqlite3
 from datetime import datetime
 import face_recognition
+import dlib
 from werkzeug.utils import secure_filename
 import json
+import math
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import numba
+except ImportError:  # Optional: batch matching falls back to NumPy
+    numba = None
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    _jpeg = TurboJPEG()
+except (ImportError, RuntimeError):  # Optional: JPEG decoding falls back to PIL
+    _jpeg = None
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'  # Change this to a random secret key
@@ -20,6 +38,12 @@ UPLOAD_FOLDER = 'static/student_photos'
 ENCODINGS_FOLDER = 'face_encodings'
 DATABASE = 'students.db'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+RECOGNITION_THRESHOLD = 0.6
+RECOGNITION_THRESHOLD_SQ = RECOGNITION_THRESHOLD ** 2
+STUDENTS_PER_PAGE = 50
+MAX_IMAGE_EDGE = 800  # Longest side (px) fed to the face detector
+# The CNN detector is only worth it when dlib was built with CUDA
+FACE_DETECTION_MODEL = 'cnn' if dlib.DLIB_USE_CUDA else 'hog'
 
 # Create necessary directories
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -27,13 +51,51 @@ os.makedirs(ENCODINGS_FOLDER, exist_ok=True)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# All enrolled encodings live in one flat float32 file (128 values per row);
+# ids.txt holds the owning student ID for each row, in the same order
+ENCODINGS_FILE = os.path.join(ENCODINGS_FOLDER, 'encodings.f32')
+ENCODING_IDS_FILE = os.path.join(ENCODINGS_FOLDER, 'ids.txt')
+_encodings_file_lock = threading.Lock()
+
+# In-memory copy of every stored encoding, stacked into one (N, 128) matrix so
+# verification never has to go back to SQLite or re-parse JSON
+ENCODINGS_CACHE = {
+    'version': 0,
+    'ids': [],
+    'names': [],
+    'M': np.empty((0, 128), dtype=np.float32),
+    'sq_norms': np.empty(0, dtype=np.float32),  # ||k||^2 per row of M
+}
+_cache_lock = threading.Lock()
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def connect_db():
+    """Open a database connection with write-friendly pragmas"""
+    conn = sqlite3.connect(DATABASE, cached_statements=256)
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+def get_db():
+    """Return the connection for the current request, opening it on first use"""
+    db = getattr(g, '_db', None)
+    if db is None:
+        db = g._db = connect_db()
+    return db
+
+@app.teardown_appcontext
+def close_db(exception):
+    db = g.pop('_db', None)
+    if db is not None:
+        db.close()
+
 def init_db():
     """Initialize the database"""
-    conn = sqlite3.connect(DATABASE)
+    conn = connect_db()
+    # Persistent in students.db, like in database.init_enhanced_db
+    conn.execute('PRAGMA journal_mode=WAL')
     c = conn.cursor()
     c.execute('''
         CREATE TABLE IF NOT EXISTS students (
@@ -44,21 +106,111 @@ def init_db():
             index_number TEXT UNIQUE NOT NULL,
             student_id TEXT UNIQUE NOT NULL,
             photo_path TEXT,
-            face_encoding TEXT,
+            face_encoding BLOB,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
     conn.commit()
     conn.close()
 
-def save_face_encoding(image_path, student_id):
-    """Extract and save face encoding from image"""
+def load_image(image_file):
+    """Decode a photo (path or file object) to an RGB array, using libjpeg-turbo for JPEGs"""
+    if _jpeg is not None:
+        if isinstance(image_file, str):
+            with open(image_file, 'rb') as f:
+                data = f.read()
+        else:
+            data = image_file.read()
+        if data[:3] == b'\xff\xd8\xff':
+            return _jpeg.decode(data, pixel_format=TJPF_RGB)
+        image_file = io.BytesIO(data)
+    return face_recognition.load_image_file(image_file)
+
+def downscale_image(image):
+    """Shrink large photos so the longest side is at most MAX_IMAGE_EDGE"""
+    scale = MAX_IMAGE_EDGE / max(image.shape[:2])
+    if scale < 1:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return image
+
+def encode_faces(image):
+    """Detect faces without upsampling and return their 128-d encodings"""
+    boxes = face_recognition.face_locations(
+        image, number_of_times_to_upsample=0, model=FACE_DETECTION_MODEL
+    )
+    return face_recognition.face_encodings(image, known_face_locations=boxes, num_jitters=1)
+
+def _encode_one(image_file):
+    """Load a single photo (path or file object) and return its face encodings
+    
+    Returns None when the photo can't be read; any other error propagates.
+    """
+    try:
+        image = load_image(image_file)
+    except OSError as e:
+        app.logger.warning("Could not read image %s: %s",
+                           image_file if isinstance(image_file, str) else 'upload', e)
+        return None
+    return encode_faces(downscale_image(image))
+
+def _encode_many(image_files):
+    """Encode several photos concurrently, one worker per CPU core"""
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        return list(executor.map(_encode_one, image_files))
+
+def _fsync_write(path, data, mode='wb'):
+    with open(path, mode) as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+def append_encoding_file(student_id, encoding):
+    """Append one encoding row to ENCODINGS_FILE and record its student ID"""
+    with _encodings_file_lock:
+        # Row before ID, both synced, so a crash can only leave an extra row,
+        # which load_encoding_file detects
+        _fsync_write(ENCODINGS_FILE, np.asarray(encoding, dtype=np.float32).tobytes(), 'ab')
+        _fsync_write(ENCODING_IDS_FILE, f"{student_id}\n", 'a')
+
+def write_encoding_file(ids, M):
+    """Replace ENCODINGS_FILE and its IDs with the given rows"""
+    with _encodings_file_lock:
+        # Without an IDs file the pair is treated as missing, so a crash
+        # part-way through never pairs new rows with old IDs
+        if os.path.exists(ENCODING_IDS_FILE):
+            os.remove(ENCODING_IDS_FILE)
+        for path, data in ((ENCODINGS_FILE, np.ascontiguousarray(M, dtype=np.float32).tobytes()),
+                           (ENCODING_IDS_FILE, ''.join(f"{i}\n" for i in ids).encode())):
+            _fsync_write(path + '.tmp', data)
+            os.replace(path + '.tmp', path)
+
+def load_encoding_file():
+    """Memory-map ENCODINGS_FILE as an (N, 128) matrix alongside its student IDs
+    
+    Returns None when either file is missing or they disagree on the row count.
+    """
+    try:
+        with open(ENCODING_IDS_FILE) as f:
+            ids = f.read().split()
+        size = os.path.getsize(ENCODINGS_FILE)
+    except FileNotFoundError:
+        return None
+    if size != len(ids) * 128 * 4:
+        return None
+    if not ids:
+        return ids, np.empty((0, 128), dtype=np.float32)
+    return ids, np.memmap(ENCODINGS_FILE, dtype=np.float32, mode='r', shape=(len(ids), 128))
+
+def extract_face_encoding(image):
+    """Extract the single face encoding from an image path or RGB array"""
     try:
         # Load image
-        image = face_recognition.load_image_file(image_path)
+        if isinstance(image, str):
+            image = load_image(image)
+        image = downscale_image(image)
         
         # Get face encodings
-        face_encodings = face_recognition.face_encodings(image)
+        face_encodings = encode_faces(image)
         
         if len(face_encodings) == 0:
             return None, "No face detected in the image"
@@ -66,16 +218,152 @@ def save_face_encoding(image_path, student_id):
         if len(face_encodings) > 1:
             return None, "Multiple faces detected. Please use an image with only one face"
         
-        # Save encoding
-        encoding = face_encodings[0]
-        encoding_file = os.path.join(ENCODINGS_FOLDER, f"{student_id}.npy")
-        np.save(encoding_file, encoding)
-        
-        return encoding.tolist(), None
+        return np.asarray(face_encodings[0], dtype=np.float32), None
         
     except Exception as e:
         return None, f"Error processing face: {str(e)}"
 
+def encoding_to_blob(encoding):
+    """Serialize an encoding as raw float32 bytes (512 bytes) for storage"""
+    return sqlite3.Binary(np.asarray(encoding, dtype=np.float32).tobytes())
+
+def decode_encoding(value):
+    """Turn a stored face_encoding value back into a float32 vector"""
+    if isinstance(value, str):
+        # Rows written before the BLOB switch hold a JSON list
+        return np.asarray(json.loads(value), dtype=np.float32)
+    return np.frombuffer(value, dtype=np.float32)
+
+def _rebuild_cache(from_file=True):
+    """Load all stored encodings into ENCODINGS_CACHE
+    
+    The matrix is memory-mapped from ENCODINGS_FILE when it covers exactly the
+    students in the database; otherwise it is rebuilt from SQLite and the file
+    rewritten.
+    """
+    conn = connect_db()
+    c = conn.cursor()
+    c.execute('SELECT student_id, first_name, last_name FROM students WHERE face_encoding IS NOT NULL')
+    names = {row[0]: f"{row[1]} {row[2]}" for row in c.fetchall()}
+    
+    loaded = load_encoding_file() if from_file else None
+    if loaded is not None:
+        file_ids, M = loaded
+        # The file is append-only, so a later row for a student supersedes earlier ones
+        latest = {sid: i for i, sid in enumerate(file_ids)}
+        if latest.keys() != names.keys():
+            loaded = None
+        elif len(latest) < len(file_ids):
+            rows = sorted(latest.values())
+            ids, M = [file_ids[i] for i in rows], np.array(M[rows])
+            write_encoding_file(ids, M)
+        else:
+            ids = file_ids
+    
+    if loaded is None:
+        c.execute('SELECT student_id, face_encoding FROM students WHERE face_encoding IS NOT NULL')
+        rows = c.fetchall()
+        ids = [row[0] for row in rows]
+        M = np.empty((len(rows), 128), dtype=np.float32)
+        for i, row in enumerate(rows):
+            M[i] = decode_encoding(row[1])
+        write_encoding_file(ids, M)
+    conn.close()
+    
+    sq_norms = np.einsum('ij,ij->i', M, M)
+    # Raw dlib descriptors have norms of roughly 1.3-1.5; unit-length rows were
+    # stored by an earlier build and don't fit the 0.6 distance threshold
+    unit_rows = int(np.count_nonzero(np.abs(sq_norms - 1) < 1e-3))
+    if unit_rows:
+        app.logger.warning("%d stored encodings are unit-length; run 'python app.py --reencode' "
+                           "to restore raw descriptors", unit_rows)
+    
+    with _cache_lock:
+        ENCODINGS_CACHE['ids'] = ids
+        ENCODINGS_CACHE['names'] = [names[sid] for sid in ids]
+        ENCODINGS_CACHE['M'] = M
+        ENCODINGS_CACHE['sq_norms'] = sq_norms
+        ENCODINGS_CACHE['version'] += 1
+
+def _get_cache():
+    """Return a consistent (ids, names, M, sq_norms) snapshot, loading it on first use"""
+    if ENCODINGS_CACHE['version'] == 0:
+        _rebuild_cache()
+    with _cache_lock:
+        return (ENCODINGS_CACHE['ids'], ENCODINGS_CACHE['names'],
+                ENCODINGS_CACHE['M'], ENCODINGS_CACHE['sq_norms'])
+
+def _add_to_cache(student_id, name, encoding):
+    """Append a newly registered student without reloading the whole table"""
+    if ENCODINGS_CACHE['version'] == 0:
+        # Not loaded yet; the first verification will pick the row up from the DB
+        return
+    encoding = np.asarray(encoding, dtype=np.float32)
+    with _cache_lock:
+        ENCODINGS_CACHE['ids'] = ENCODINGS_CACHE['ids'] + [student_id]
+        ENCODINGS_CACHE['names'] = ENCODINGS_CACHE['names'] + [name]
+        ENCODINGS_CACHE['M'] = np.vstack([ENCODINGS_CACHE['M'], encoding])
+        ENCODINGS_CACHE['sq_norms'] = np.append(ENCODINGS_CACHE['sq_norms'], encoding @ encoding)
+        ENCODINGS_CACHE['version'] += 1
+
+def reencode_students():
+    """Recompute every stored encoding from the student photos on disk"""
+    conn = connect_db()
+    c = conn.cursor()
+    c.execute('SELECT id, photo_path FROM students WHERE photo_path IS NOT NULL')
+    rows = [row for row in c.fetchall() if os.path.exists(row[1])]
+    
+    updated = 0
+    for (row_id, _), encodings in zip(rows, _encode_many([row[1] for row in rows])):
+        if encodings is not None and len(encodings) == 1:
+            c.execute('UPDATE students SET face_encoding = ? WHERE id = ?',
+                      (encoding_to_blob(encodings[0]), row_id))
+            updated += 1
+    conn.commit()
+    conn.close()
+    
+    # Rebuild from SQLite so the encodings file picks up the new rows
+    _rebuild_cache(from_file=False)
+    return updated
+
+def face_scores(known, sq_norms, encoding):
+    """||k||^2 - 2 k.q for every row k of an (N, 128) matrix
+    
+    This is the squared distance minus the constant ||q||^2, so it ranks rows
+    with a single GEMV; add q.q to the winner alone to test the threshold.
+    """
+    return sq_norms - 2 * (known @ np.asarray(encoding, dtype=np.float32))
+
+def _batch_best_match(M, sq_norms, queries, max_sq):
+    """Index of and squared distance to the closest row of M under max_sq (-1 if none)"""
+    scores = sq_norms[None, :] - 2 * (queries @ M.T)
+    idx = scores.argmin(axis=1)
+    best = scores[np.arange(len(queries)), idx] + np.einsum('ij,ij->i', queries, queries)
+    return np.where(best < max_sq, idx, -1), best
+
+if numba is not None:
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _batch_best_match(M, sq_norms, queries, max_sq):
+        out = np.empty(queries.shape[0], dtype=np.float32)
+        idx = np.empty(queries.shape[0], dtype=np.int64)
+        for q in numba.prange(queries.shape[0]):
+            best = max_sq
+            bi = -1
+            for i in range(M.shape[0]):
+                s = 0.0
+                for k in range(M.shape[1]):
+                    d = M[i, k] - queries[q, k]
+                    s += d * d
+                    # Partial sums only grow, so stop once this row can't win
+                    if s >= best:
+                        break
+                if s < best:
+                    best = s
+                    bi = i
+            out[q] = best
+            idx[q] = bi
+        return idx, out
+
 def validate_student_data(data):
     """Validate student registration data"""
     errors = []
@@ -115,21 +403,11 @@ def register():
                 flash(error, 'error')
             return redirect(url_for('register'))
         
-        # Check if student already exists
-        conn = sqlite3.connect(DATABASE)
-        c = conn.cursor()
-        c.execute('SELECT id FROM students WHERE index_number = ? OR student_id = ?', 
-                 (request.form['index_number'], request.form['student_id']))
-        existing = c.fetchone()
-        conn.close()
-        
-        if existing:
-            flash('Student with this index number or student ID already exists', 'error')
-            return redirect(url_for('register'))
-        
-        # Handle file upload or camera capture
+        # Handle file upload or camera capture. The photo and encoding are only
+        # kept once the student row has been committed.
         photo_path = None
-        face_encoding_json = None
+        upload_path = None
+        face_encoding_blob = None
         
         # Check if image was uploaded
         if 'photo' in request.files and request.files['photo'].filename:
@@ -137,15 +415,19 @@ def register():
             if file and allowed_file(file.filename):
                 filename = secure_filename(f"{request.form['student_id']}_{file.filename}")
                 photo_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(photo_path)
+                
+                # Stage the upload under a temporary name until registration succeeds
+                with tempfile.NamedTemporaryFile(dir=app.config['UPLOAD_FOLDER'], suffix='.tmp', delete=False) as tmp:
+                    file.save(tmp)
+                upload_path = tmp.name
                 
                 # Process face encoding
-                encoding, error = save_face_encoding(photo_path, request.form['student_id'])
+                encoding, error = extract_face_encoding(upload_path)
                 if error:
                     flash(f'Face processing error: {error}', 'error')
-                    os.remove(photo_path)  # Clean up
+                    os.remove(upload_path)  # Clean up
                     return redirect(url_for('register'))
-                face_encoding_json = json.dumps(encoding)
+                face_encoding_blob = encoding_to_blob(encoding)
         
         # Check if camera data was submitted
         elif 'camera_data' in request.form and request.form['camera_data']:
@@ -153,21 +435,22 @@ def register():
                 # Decode base64 image
                 image_data = request.form['camera_data'].split(',')[1]
                 image_binary = base64.b64decode(image_data)
+                image = load_image(io.BytesIO(image_binary))
                 
-                # Save image
-                filename = f"{request.form['student_id']}_camera.jpg"
-                photo_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                
-                with open(photo_path, 'wb') as f:
-                    f.write(image_binary)
-                
-                # Process face encoding
-                encoding, error = save_face_encoding(photo_path, request.form['student_id'])
+                # Process face encoding straight from memory
+                encoding, error = extract_face_encoding(image)
                 if error:
                     flash(f'Face processing error: {error}', 'error')
-                    os.remove(photo_path)  # Clean up
                     return redirect(url_for('register'))
-                face_encoding_json = json.dumps(encoding)
+                face_encoding_blob = encoding_to_blob(encoding)
+                
+                filename = f"{request.form['student_id']}_camera.jpg"
+                photo_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                
+                # Stage the capture on disk like an upload, before the row exists
+                with tempfile.NamedTemporaryFile(dir=app.config['UPLOAD_FOLDER'], suffix='.tmp', delete=False) as tmp:
+                    tmp.write(image_binary)
+                upload_path = tmp.name
                 
             except Exception as e:
                 flash(f'Camera image processing error: {str(e)}', 'error')
@@ -177,46 +460,74 @@ def register():
             flash('Please provide a photo either by upload or camera capture', 'error')
             return redirect(url_for('register'))
         
-        # Save to database
+        # Save to database. Either UNIQUE column conflicting means the student
+        # already exists, which the insert itself reports by returning no row.
         try:
-            conn = sqlite3.connect(DATABASE)
-            c = conn.cursor()
-            c.execute('''
-                INSERT INTO students (first_name, middle_name, last_name, index_number, 
-                                    student_id, photo_path, face_encoding)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                request.form['first_name'].strip(),
-                request.form.get('middle_name', '').strip() or None,
-                request.form['last_name'].strip(),
-                request.form['index_number'].strip(),
-                request.form['student_id'].strip(),
-                photo_path,
-                face_encoding_json
-            ))
-            conn.commit()
-            conn.close()
+            conn = get_db()
+            with conn:
+                c = conn.cursor()
+                c.execute('''
+                    INSERT INTO students (first_name, middle_name, last_name, index_number, 
+                                        student_id, photo_path, face_encoding)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT DO NOTHING
+                    RETURNING id
+                ''', (
+                    request.form['first_name'].strip(),
+                    request.form.get('middle_name', '').strip() or None,
+                    request.form['last_name'].strip(),
+                    request.form['index_number'].strip(),
+                    request.form['student_id'].strip(),
+                    photo_path,
+                    face_encoding_blob
+                ))
+                inserted = c.fetchone()
+            
+            if inserted is None:
+                flash('Student with this index number or student ID already exists', 'error')
+                if upload_path:
+                    os.remove(upload_path)  # Clean up
+                return redirect(url_for('register'))
+            
+            if upload_path:
+                os.replace(upload_path, photo_path)
+            
+            if face_encoding_blob:
+                append_encoding_file(request.form['student_id'].strip(), encoding)
+                _add_to_cache(
+                    request.form['student_id'].strip(),
+                    f"{request.form['first_name'].strip()} {request.form['last_name'].strip()}",
+                    encoding
+                )
             
             flash('Student registered successfully!', 'success')
             return redirect(url_for('students'))
             
         except Exception as e:
             flash(f'Database error: {str(e)}', 'error')
-            if photo_path and os.path.exists(photo_path):
-                os.remove(photo_path)  # Clean up
+            if upload_path and os.path.exists(upload_path):
+                os.remove(upload_path)  # Clean up
             return redirect(url_for('register'))
     
     return render_template('register.html')
 
 @app.route('/students')
 def students():
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute('SELECT * FROM students ORDER BY created_at DESC')
+    page = max(request.args.get('page', 1, type=int), 1)
+    
+    # Keep the template's column positions but never pull the encoding itself;
+    # one extra row tells us whether a next page exists without a COUNT query
+    c = get_db().cursor()
+    c.execute('''
+        SELECT id, first_name, middle_name, last_name, index_number, student_id,
+               photo_path, face_encoding IS NOT NULL, created_at
+        FROM students ORDER BY created_at DESC LIMIT ? OFFSET ?
+    ''', (STUDENTS_PER_PAGE + 1, (page - 1) * STUDENTS_PER_PAGE))
     students_data = c.fetchall()
-    conn.close()
+    has_next = len(students_data) > STUDENTS_PER_PAGE
     
-    return render_template('students.html', students=students_data)
+    return render_template('students.html', students=students_data[:STUDENTS_PER_PAGE],
+                           page=page, has_next=has_next)
 
 @app.route('/verify')
 def verify():
@@ -233,48 +544,34 @@ def verify_face():
         if file.filename == '':
             return jsonify({'success': False, 'message': 'No image selected'})
         
-        # Save temporary image
-        temp_path = os.path.join(UPLOAD_FOLDER, 'temp_verify.jpg')
-        file.save(temp_path)
-        
-        # Load and encode the verification image
-        verify_image = face_recognition.load_image_file(temp_path)
-        verify_encodings = face_recognition.face_encodings(verify_image)
+        # Decode the upload straight from the request stream; nothing touches disk
+        verify_image = downscale_image(load_image(file.stream))
+        verify_encodings = encode_faces(verify_image)
         
         if len(verify_encodings) == 0:
-            os.remove(temp_path)
             return jsonify({'success': False, 'message': 'No face detected in image'})
         
-        verify_encoding = verify_encodings[0]
-        
+        verify_encoding = np.asarray(verify_encodings[0], dtype=np.float32)
+
         # Compare with all registered students
-        conn = sqlite3.connect(DATABASE)
-        c = conn.cursor()
-        c.execute('SELECT student_id, first_name, last_name, face_encoding FROM students WHERE face_encoding IS NOT NULL')
-        students = c.fetchall()
-        conn.close()
+        ids, names, known, sq_norms = _get_cache()
         
         best_match = None
-        best_distance = float('inf')
         
-        for student in students:
-            student_id, first_name, last_name, encoding_json = student
-            stored_encoding = np.array(json.loads(encoding_json))
-            
-            # Calculate face distance
-            distance = face_recognition.face_distance([stored_encoding], verify_encoding)[0]
+        if len(ids):
+            # Every distance in a single pass over the cached (N, 128) matrix
+            scores = face_scores(known, sq_norms, verify_encoding)
+            best_index = int(scores.argmin())
+            best_sq = float(scores[best_index]) + float(verify_encoding @ verify_encoding)
             
-            if distance < best_distance and distance < 0.6:  # Threshold for match
-                best_distance = distance
+            if best_sq < RECOGNITION_THRESHOLD_SQ:
+                best_distance = math.sqrt(max(best_sq, 0.0))
                 best_match = {
-                    'student_id': student_id,
-                    'name': f"{first_name} {last_name}",
-                    'confidence': round((1 - distance) * 100, 2)
+                    'student_id': ids[best_index],
+                    'name': names[best_index],
+                    'confidence': round((1 - best_distance) * 100, 2)
                 }
         
-        # Clean up
-        os.remove(temp_path)
-        
         if best_match:
             return jsonify({
                 'success': True, 
@@ -287,6 +584,54 @@ def verify_face():
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error: {str(e)}'})
 
+@app.route('/verify_batch', methods=['POST'])
+def verify_batch():
+    """Match every face in one or more uploaded images in a single pass"""
+    try:
+        files = [f for f in request.files.getlist('images') if f.filename]
+        if not files:
+            return jsonify({'success': False, 'message': 'No images provided'})
+        
+        per_image = _encode_many([f.stream for f in files])
+        queries = np.asarray([enc for encodings in per_image if encodings for enc in encodings],
+                             dtype=np.float32).reshape(-1, 128)
+        
+        ids, names, known, sq_norms = _get_cache()
+        matches = [None] * len(queries)
+        
+        if len(queries) and len(ids):
+            indices, squared = _batch_best_match(known, sq_norms, queries, RECOGNITION_THRESHOLD_SQ)
+            for q, (i, sq) in enumerate(zip(indices, squared)):
+                if i >= 0:
+                    distance = math.sqrt(max(float(sq), 0.0))
+                    matches[q] = {
+                        'student_id': ids[i],
+                        'name': names[i],
+                        'confidence': round((1 - distance) * 100, 2)
+                    }
+        
+        results = []
+        offset = 0
+        for image_file, encodings in zip(files, per_image):
+            if encodings is None:
+                results.append({'filename': image_file.filename, 'error': 'Could not read image'})
+                continue
+            found = matches[offset:offset + len(encodings)]
+            results.append({
+                'filename': image_file.filename,
+                'faces_detected': len(encodings),
+                'students': [match for match in found if match]
+            })
+            offset += len(encodings)
+        
+        return jsonify({'success': True, 'results': results})
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+
 if __name__ == '__main__':
     init_db()
-    app.run(debug=True, host='0.0.0.0', port=5001)
+    if '--reencode' in sys.argv:
+        print(f"Re-encoded {reencode_students()} students")
+    else:
+        app.run(debug=True, host='0.0.0.0', port=5001)
@@ -1,21 +1,74 @@
 # Enhanced Database Schema and Management
 import sqlite3
 import hashlib
+import hmac
 import secrets
+import queue
+import threading
 from datetime import datetime, timedelta
 import json
+import numpy as np
 
 DATABASE = 'enhanced_students.db'
 
-def get_db_connection():
+def get_db_connection(**kwargs):
     """Get database connection with row factory"""
-    conn = sqlite3.connect(DATABASE)
+    conn = sqlite3.connect(DATABASE, cached_statements=256, **kwargs)
     conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-64000')  # 64 MB page cache
     return conn
 
+# Bounded pool of open connections shared by request threads
+DB_POOL_SIZE = 8
+DB_POOL_TIMEOUT = 10  # Seconds to wait for a free connection
+_idle_connections = queue.LifoQueue()
+_pool_slots = threading.BoundedSemaphore(DB_POOL_SIZE)
+
+def acquire_connection():
+    """Take a connection from the pool, opening one if a slot is free"""
+    if not _pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        raise sqlite3.OperationalError('Timed out waiting for a database connection')
+    try:
+        return _idle_connections.get_nowait()
+    except queue.Empty:
+        pass
+    try:
+        return get_db_connection(check_same_thread=False)
+    except Exception:
+        _pool_slots.release()
+        raise
+
+def release_connection(conn):
+    """Return a connection to the pool, discarding any uncommitted work"""
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        _idle_connections.put(conn)
+    except sqlite3.Error:
+        conn.close()
+    finally:
+        _pool_slots.release()
+
+def encoding_to_blob(encoding):
+    """Serialize a face encoding as raw float32 bytes (512 bytes) for storage"""
+    return sqlite3.Binary(np.asarray(encoding, dtype=np.float32).tobytes())
+
+def decode_encoding(value):
+    """Turn a stored face_encoding value back into a float32 vector"""
+    if isinstance(value, str):
+        # Rows written before the BLOB switch hold a JSON list of floats; parse it
+        # straight into an array instead of building 128 Python floats first
+        return np.fromstring(value.strip('[] \n'), sep=',', dtype=np.float32)
+    return np.frombuffer(value, dtype=np.float32)
+
 def init_enhanced_db():
     """Initialize comprehensive database schema"""
     conn = get_db_connection()
+    # journal_mode=WAL is stored in the database file itself, so setting it at
+    # init covers every later connection from either app, not just this one
+    conn.execute('PRAGMA journal_mode=WAL')
     c = conn.cursor()
     
     # Colleges/Universities table
@@ -120,7 +173,7 @@ def init_enhanced_db():
             academic_year_id INTEGER,
             admission_year INTEGER,
             photo_path TEXT,
-            face_encoding TEXT,
+            face_encoding BLOB,
             status TEXT DEFAULT 'active',
             created_by INTEGER,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -232,7 +285,7 @@ def init_enhanced_db():
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             student_id INTEGER,
             exam_session_id INTEGER,
-            verification_time TIMESTAMP,
+            verification_time TIMESTAMP DEFAULT (datetime('now', 'localtime')),
             room_assignment TEXT,
             seat_assignment TEXT,
             verification_method TEXT DEFAULT 'face_recognition',
@@ -277,6 +330,47 @@ def init_enhanced_db():
         )
     ''')
     
+    # Indexes for the verification scan, JOINs and dashboard date filters
+    c.executescript('''
+        CREATE INDEX IF NOT EXISTS idx_students_active_enc ON students(status)
+            WHERE status = 'active' AND face_encoding IS NOT NULL;
+        CREATE INDEX IF NOT EXISTS idx_students_college ON students(college_id);
+        CREATE INDEX IF NOT EXISTS idx_students_department ON students(department_id);
+        CREATE INDEX IF NOT EXISTS idx_reclog_created ON recognition_logs(created_at);
+        CREATE INDEX IF NOT EXISTS idx_attendance_student ON exam_attendance(student_id);
+    ''')
+    
+    # Full-text index over student names/IDs; trigram tokens keep substring search
+    fts_exists = c.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'students_fts'"
+    ).fetchone()
+    c.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS students_fts USING fts5(
+            student_id, first_name, last_name,
+            content='students', content_rowid='id', tokenize='trigram'
+        )
+    ''')
+    c.executescript('''
+        CREATE TRIGGER IF NOT EXISTS students_fts_insert AFTER INSERT ON students BEGIN
+            INSERT INTO students_fts (rowid, student_id, first_name, last_name)
+            VALUES (new.id, new.student_id, new.first_name, new.last_name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS students_fts_delete AFTER DELETE ON students BEGIN
+            INSERT INTO students_fts (students_fts, rowid, student_id, first_name, last_name)
+            VALUES ('delete', old.id, old.student_id, old.first_name, old.last_name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS students_fts_update
+        AFTER UPDATE OF student_id, first_name, last_name ON students BEGIN
+            INSERT INTO students_fts (students_fts, rowid, student_id, first_name, last_name)
+            VALUES ('delete', old.id, old.student_id, old.first_name, old.last_name);
+            INSERT INTO students_fts (rowid, student_id, first_name, last_name)
+            VALUES (new.id, new.student_id, new.first_name, new.last_name);
+        END;
+    ''')
+    if not fts_exists:
+        # Index students that were added before the FTS table existed
+        c.execute("INSERT INTO students_fts (students_fts) VALUES ('rebuild')")
+    
     # Insert default data
     insert_default_data(c)
     
@@ -284,7 +378,7 @@ def init_enhanced_db():
     conn.close()
 
 def insert_default_data(cursor):
-    """Insert default system data"""
+    """Insert default system data (committed once by init_enhanced_db)"""
     
     # Default college
     cursor.execute('''
@@ -299,7 +393,7 @@ def insert_default_data(cursor):
     ''')
     
     # Default admin user (password: admin123)
-    password_hash = hashlib.sha256('admin123'.encode()).hexdigest()
+    password_hash = hash_password('admin123')
     cursor.execute('''
         INSERT OR IGNORE INTO admins (username, email, password_hash, full_name, role, college_id)
         VALUES (?, ?, ?, ?, ?, ?)
@@ -315,11 +409,10 @@ def insert_default_data(cursor):
         ('recognition_confidence_threshold', '0.8', 'Minimum confidence for recognition', 'recognition')
     ]
     
-    for setting in default_settings:
-        cursor.execute('''
-            INSERT OR IGNORE INTO system_settings (setting_key, setting_value, description, category)
-            VALUES (?, ?, ?, ?)
-        ''', setting)
+    cursor.executemany('''
+        INSERT OR IGNORE INTO system_settings (setting_key, setting_value, description, category)
+        VALUES (?, ?, ?, ?)
+    ''', default_settings)
     
     # Default academic years
     academic_years = [
@@ -329,11 +422,10 @@ def insert_default_data(cursor):
         ('2026/2027', 2026, 2027, False),
     ]
     
-    for year in academic_years:
-        cursor.execute('''
-            INSERT OR IGNORE INTO academic_years (year_code, start_year, end_year, is_current)
-            VALUES (?, ?, ?, ?)
-        ''', year)
+    cursor.executemany('''
+        INSERT OR IGNORE INTO academic_years (year_code, start_year, end_year, is_current)
+        VALUES (?, ?, ?, ?)
+    ''', academic_years)
     
     # Sample exam rooms
     exam_rooms = [
@@ -344,26 +436,40 @@ def insert_default_data(cursor):
         ('LAB201', 'Computer Lab Block', 30, 1),
     ]
     
-    for room in exam_rooms:
-        cursor.execute('''
-            INSERT OR IGNORE INTO exam_rooms (room_number, building, capacity, college_id)
-            VALUES (?, ?, ?, ?)
-        ''', room)
+    cursor.executemany('''
+        INSERT OR IGNORE INTO exam_rooms (room_number, building, capacity, college_id)
+        VALUES (?, ?, ?, ?)
+    ''', exam_rooms)
+
+# scrypt cost parameters for new password hashes
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=bytes.fromhex(salt),
+                          n=n, r=r, p=p, dklen=32).hex()
 
 def hash_password(password):
-    """Hash password with salt"""
+    """Hash password with scrypt and a random salt"""
     salt = secrets.token_hex(16)
-    password_hash = hashlib.sha256((password + salt).encode()).hexdigest()
-    return f"{salt}:{password_hash}"
+    password_hash = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt}${password_hash}"
 
 def verify_password(password, hashed):
     """Verify password against hash"""
     try:
-        salt, hash_part = hashed.split(':')
-        return hashlib.sha256((password + salt).encode()).hexdigest() == hash_part
+        if hashed.startswith('scrypt$'):
+            _, n, r, p, salt, hash_part = hashed.split('$')
+            candidate = _scrypt(password, salt, int(n), int(r), int(p))
+        else:
+            # Legacy salted SHA-256 hashes
+            salt, hash_part = hashed.split(':')
+            candidate = hashlib.sha256((password + salt).encode()).hexdigest()
+        return hmac.compare_digest(candidate, hash_part)
     except:
         # Fallback for simple hash (backward compatibility)
-        return hashlib.sha256(password.encode()).hexdigest() == hashed
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), hashed)
 
 def migrate_database():
     """Migrate database to latest schema"""
@@ -383,6 +489,17 @@ def migrate_database():
             print("Migration completed successfully!")
         else:
             print("Database is already up to date.")
+        
+        # Convert JSON text encodings to raw float32 BLOBs
+        rows = c.execute(
+            "SELECT id, face_encoding FROM students WHERE typeof(face_encoding) = 'text'"
+        ).fetchall()
+        if rows:
+            print(f"Converting {len(rows)} face encodings to float32 BLOBs...")
+            c.executemany(
+                'UPDATE students SET face_encoding = ? WHERE id = ?',
+                [(encoding_to_blob(decode_encoding(row['face_encoding'])), row['id']) for row in rows]
+            )
             
     except Exception as e:
         print(f"Migration error: {e}")
@@ -5,8 +5,9 @@ This ensures face detection works reliably without depending on external CDNs.
 """
 
 import os
-import urllib.request
 import shutil
+from concurrent.futures import ThreadPoolExecutor
+import requests
 
 # Create directories if they don't exist
 WEIGHTS_DIR = os.path.join('static', 'js', 'face-api', 'weights')
@@ -32,26 +33,36 @@ MODEL_FILES = [
     'face_recognition_model-shard2'
 ]
 
-print("Downloading face-api.js library...")
-try:
-    urllib.request.urlretrieve(FACE_API_URL, FACE_API_PATH)
-    print(f"Downloaded face-api.js to {FACE_API_PATH}")
-except Exception as e:
-    print(f"Error downloading face-api.js: {e}")
+# One pooled session so every file reuses the same keep-alive connections
+session = requests.Session()
+session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=8))
 
-# Download model files directly from the jsdelivr CDN
-print("\nDownloading model files...")
-BASE_URL = 'https://raw.githubusercontent.com/justadudewhohacks/face-api.js/master/weights/'
+def fetch(url, dest):
+    """Stream url to dest in 1 MB chunks"""
+    with session.get(url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        # Let urllib3 undo any gzip transfer encoding while streaming
+        response.raw.decode_content = True
+        with open(dest, 'wb') as f:
+            shutil.copyfileobj(response.raw, f, length=1 << 20)
 
-for file in MODEL_FILES:
+def download(name, url, dest):
     try:
-        url = BASE_URL + file
-        dest = os.path.join(WEIGHTS_DIR, file)
-        print(f"Downloading {file}...")
-        urllib.request.urlretrieve(url, dest)
-        print(f"Downloaded {file} to {dest}")
+        print(f"Downloading {name}...")
+        fetch(url, dest)
+        print(f"Downloaded {name} to {dest}")
     except Exception as e:
-        print(f"Error downloading {file}: {e}")
+        print(f"Error downloading {name}: {e}")
+
+# Download model files directly from GitHub
+BASE_URL = 'https://raw.githubusercontent.com/justadudewhohacks/face-api.js/master/weights/'
+
+downloads = [('face-api.js', FACE_API_URL, FACE_API_PATH)]
+downloads += [(file, BASE_URL + file, os.path.join(WEIGHTS_DIR, file)) for file in MODEL_FILES]
+
+print("Downloading face-api.js library and model files...")
+with ThreadPoolExecutor(max_workers=8) as executor:
+    list(executor.map(lambda args: download(*args), downloads))
 
 print("\nDownload complete! The models are now available locally.")
 print("Update your HTML to use local files with:")
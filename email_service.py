@@ -2,118 +2,133 @@
 # email_service.py
 
 import smtplib
+import asyncio
 import logging
 import ssl
 import os
-from typing import Optional, List
-from dotenv import load_dotenv
+import atexit
+import queue
+import re
+import socket
+import string
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from email import encoders
+from email.message import EmailMessage
+from email.utils import formataddr, formatdate, make_msgid
+import weakref
+from typing import Optional, List, Union
 
-# Load environment variables from .env file
-load_dotenv()
+try:
+    import aiosmtplib
+except ImportError:  # Optional: send_email_async falls back to the thread pool
+    aiosmtplib = None
 
-class EmailService:
-    """Email service class supporting multiple providers"""
-    
-    def __init__(self, provider='gmail', **kwargs):
-        self.provider = provider.lower()
-        self.config = self._get_config(provider, **kwargs)
-        
-    def _get_config(self, provider, **kwargs):
-        """Get configuration for different email providers"""
-        configs = {
-            'gmail': {
-                'smtp_server': 'smtp.gmail.com',
-                'smtp_port': 587,
-                'use_tls': True,
-                'username': kwargs.get('username') or os.getenv('GMAIL_USERNAME'),
-                'password': kwargs.get('password') or os.getenv('GMAIL_APP_PASSWORD'),
-            },
-            'outlook': {
-                'smtp_server': 'smtp-mail.outlook.com',
-                'smtp_port': 587,
-                'use_tls': True,
-                'username': kwargs.get('username') or os.getenv('OUTLOOK_USERNAME'),
-                'password': kwargs.get('password') or os.getenv('OUTLOOK_PASSWORD'),
-            },
-            'yahoo': {
-                'smtp_server': 'smtp.mail.yahoo.com',
-                'smtp_port': 587,
-                'use_tls': True,
-                'username': kwargs.get('username') or os.getenv('YAHOO_USERNAME'),
-                'password': kwargs.get('password') or os.getenv('YAHOO_PASSWORD'),
-            },
-            'custom': {
-                'smtp_server': kwargs.get('smtp_server'),
-                'smtp_port': kwargs.get('smtp_port', 587),
-                'use_tls': kwargs.get('use_tls', True),
-                'username': kwargs.get('username'),
-                'password': kwargs.get('password'),
-            }
-        }
-        
-        if provider not in configs:
-            raise ValueError(f"Unsupported email provider: {provider}")
-            
-        config = configs[provider]
-        
-        # Validate required fields
-        if not config['username'] or not config['password']:
-            raise ValueError(f"Username and password required for {provider}")
-            
-        return config
-    
-    def send_email(self, to_email: str, subject: str, body: str, 
-                   html_body: Optional[str] = None, 
-                   from_name: Optional[str] = None) -> bool:
-        """Send email with optional HTML body"""
-        try:
-            # Create message
-            from_addr = f"{from_name} <{self.config['username']}>" if from_name else self.config['username']
-            
-            # Create message body
-            if html_body:
-                message = f"""From: {from_addr}
-To: {to_email}
-Subject: {subject}
-MIME-Version: 1.0
-Content-Type: text/html; charset=utf-8
-
-{html_body}
-"""
-            else:
-                message = f"""From: {from_addr}
-To: {to_email}
-Subject: {subject}
+logger = logging.getLogger(__name__)
 
-{body}
-"""
-            
-            # Connect to server and send email
-            server = smtplib.SMTP(self.config['smtp_server'], self.config['smtp_port'])
-            
-            if self.config['use_tls']:
-                context = ssl.create_default_context()
-                server.starttls(context=context)
-            
-            server.login(self.config['username'], self.config['password'])
-            server.sendmail(self.config['username'], to_email, message.encode('utf-8'))
-            server.quit()
-            
-            logging.info(f"Email sent successfully to {to_email}")
-            return True
-            
-        except Exception as e:
-            logging.error(f"Email sending failed: {str(e)}")
-            return False
+_env_loaded = False
+
+def _load_env():
+    """Load environment variables from .env the first time a service is configured"""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
+
+# Per-provider config builders; only the chosen provider's settings are built
+def _gmail_config(kwargs):
+    return {
+        'smtp_server': 'smtp.gmail.com',
+        # Implicit TLS on 465 skips the EHLO/STARTTLS/EHLO exchange
+        'smtp_port': 465,
+        'use_ssl': True,
+        'use_tls': False,
+        'username': kwargs.get('username') or os.getenv('GMAIL_USERNAME'),
+        'password': kwargs.get('password') or os.getenv('GMAIL_APP_PASSWORD'),
+    }
+
+def _outlook_config(kwargs):
+    return {
+        'smtp_server': 'smtp-mail.outlook.com',
+        'smtp_port': 587,
+        'use_ssl': False,
+        'use_tls': True,
+        'username': kwargs.get('username') or os.getenv('OUTLOOK_USERNAME'),
+        'password': kwargs.get('password') or os.getenv('OUTLOOK_PASSWORD'),
+    }
+
+def _yahoo_config(kwargs):
+    return {
+        'smtp_server': 'smtp.mail.yahoo.com',
+        # Implicit TLS on 465 skips the EHLO/STARTTLS/EHLO exchange
+        'smtp_port': 465,
+        'use_ssl': True,
+        'use_tls': False,
+        'username': kwargs.get('username') or os.getenv('YAHOO_USERNAME'),
+        'password': kwargs.get('password') or os.getenv('YAHOO_PASSWORD'),
+    }
+
+def _custom_config(kwargs):
+    return {
+        'smtp_server': kwargs.get('smtp_server'),
+        'smtp_port': kwargs.get('smtp_port', 587),
+        'use_ssl': kwargs.get('use_ssl', int(kwargs.get('smtp_port', 587)) == 465),
+        'use_tls': kwargs.get('use_tls', True),
+        'username': kwargs.get('username'),
+        'password': kwargs.get('password'),
+    }
+
+_PROVIDERS = {
+    'gmail': _gmail_config,
+    'outlook': _outlook_config,
+    'yahoo': _yahoo_config,
+    'custom': _custom_config,
+}
+
+# Idle connections and concurrency slots, shared by every EmailService that
+# talks to the same (smtp_server, smtp_port, username)
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+# Loading the CA bundle is costly and the context is identical for every
+# provider, so build it once and share it across all connections
+_SSL_CONTEXT = ssl.create_default_context()
+
+# Cheap syntax check so obviously bad addresses never cost an SMTP round-trip
+_EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+# Seconds to wait on connect and on each reply; without it a silent server hangs forever
+SMTP_TIMEOUT = 30
+SMTP_RETRIES = 3  # Backoff retries (1s, 2s, 4s) after a 4xx reply
+
+# Background senders so HTTP handlers don't wait on the SMTP round-trip
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='email')
+
+def _get_pool(key, pool_size):
+    with _POOLS_LOCK:
+        if key not in _POOLS:
+            _POOLS[key] = (queue.Queue(maxsize=pool_size), threading.BoundedSemaphore(pool_size))
+        return _POOLS[key]
+
+def _minify_html(html):
+    """Strip indentation and squeeze the inline CSS; run once per template at import
     
-    def send_otp_email(self, to_email: str, otp: str, purpose: str = 'verification') -> bool:
-        """Send OTP email with formatted template"""
-        subject = f"Your OTP Code for {purpose.title()}"
-        
-        text_body = f"""
+    Tags stay on separate lines so no line nears SMTP's 998-character limit.
+    """
+    def squeeze_css(match):
+        css = re.sub(r'\s*([{};:,])\s*', r'\1', ' '.join(match.group(1).split()))
+        return '<style>' + css.replace('}', '}\n') + '</style>'
+    html = re.sub(r'<style>(.*?)</style>', squeeze_css, html, flags=re.S)
+    return re.sub(r'>\s+<', '>\n<', html).strip()
+
+# Message templates, parsed once at import; $name fields are filled per send.
+# HTML bodies are written readably here and minified when the module loads.
+_OTP_TEXT_TMPL = string.Template("""
 Hello,
 
-Your OTP code for {purpose} is: {otp}
+Your OTP code for $purpose is: $otp
 
 This code will expire in 10 minutes.
 
@@ -121,21 +136,21 @@ If you didn't request this code, please ignore this email.
 
 Best regards,
 Student Face Recognition System Team
-        """
-        
-        html_body = f"""
+        """)
+
+_OTP_HTML_TMPL = string.Template(_minify_html("""
 <!DOCTYPE html>
 <html>
 <head>
     <style>
-        body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-        .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-        .header {{ background: linear-gradient(135deg, #2563eb, #1e40af); color: white; padding: 20px; text-align: center; border-radius: 10px 10px 0 0; }}
-        .content {{ background: white; padding: 30px; border: 1px solid #e2e8f0; }}
-        .otp-code {{ background: #f8fafc; border: 2px dashed #2563eb; padding: 20px; text-align: center; margin: 20px 0; border-radius: 10px; }}
-        .otp-number {{ font-size: 32px; font-weight: bold; color: #2563eb; letter-spacing: 5px; }}
-        .footer {{ background: #f8fafc; padding: 20px; text-align: center; border-radius: 0 0 10px 10px; color: #6b7280; }}
-        .warning {{ background: #fef3c7; border-left: 4px solid #f59e0b; padding: 15px; margin: 20px 0; }}
+        body { font-family: Arial, sans-serif; line-height: 1.6; color: #333; }
+        .container { max-width: 600px; margin: 0 auto; padding: 20px; }
+        .header { background: linear-gradient(135deg, #2563eb, #1e40af); color: white; padding: 20px; text-align: center; border-radius: 10px 10px 0 0; }
+        .content { background: white; padding: 30px; border: 1px solid #e2e8f0; }
+        .otp-code { background: #f8fafc; border: 2px dashed #2563eb; padding: 20px; text-align: center; margin: 20px 0; border-radius: 10px; }
+        .otp-number { font-size: 32px; font-weight: bold; color: #2563eb; letter-spacing: 5px; }
+        .footer { background: #f8fafc; padding: 20px; text-align: center; border-radius: 0 0 10px 10px; color: #6b7280; }
+        .warning { background: #fef3c7; border-left: 4px solid #f59e0b; padding: 15px; margin: 20px 0; }
     </style>
 </head>
 <body>
@@ -147,11 +162,11 @@ Student Face Recognition System Team
         
         <div class="content">
             <h2>Hello!</h2>
-            <p>You have requested an OTP code for <strong>{purpose}</strong>.</p>
+            <p>You have requested an OTP code for <strong>$purpose</strong>.</p>
             
             <div class="otp-code">
                 <p>Your verification code is:</p>
-                <div class="otp-number">{otp}</div>
+                <div class="otp-number">$otp</div>
                 <p><small>Enter this code to continue</small></p>
             </div>
             
@@ -174,47 +189,35 @@ Student Face Recognition System Team
     </div>
 </body>
 </html>
-        """
-        
-        return self.send_email(
-            to_email=to_email,
-            subject=subject,
-            body=text_body,
-            html_body=html_body,
-            from_name="SFRS Admin"
-        )
-    
-    def send_welcome_email(self, to_email: str, full_name: str, username: str) -> bool:
-        """Send welcome email to new admin users"""
-        subject = "Welcome to Student Face Recognition System"
-        
-        text_body = f"""
-Hello {full_name},
+        """))
+
+_WELCOME_TEXT_TMPL = string.Template("""
+Hello $full_name,
 
 Welcome to the Student Face Recognition System!
 
 Your admin account has been successfully created with the following details:
-- Username: {username}
-- Email: {to_email}
+- Username: $username
+- Email: $to_email
 
 You can now log in to the admin dashboard and start managing students and face recognition settings.
 
 Best regards,
 SFRS Team
-        """
-        
-        html_body = f"""
+        """)
+
+_WELCOME_HTML_TMPL = string.Template(_minify_html("""
 <!DOCTYPE html>
 <html>
 <head>
     <style>
-        body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-        .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-        .header {{ background: linear-gradient(135deg, #059669, #047857); color: white; padding: 20px; text-align: center; border-radius: 10px 10px 0 0; }}
-        .content {{ background: white; padding: 30px; border: 1px solid #e2e8f0; }}
-        .welcome-box {{ background: #f0f9ff; border: 1px solid #0891b2; padding: 20px; border-radius: 10px; margin: 20px 0; }}
-        .button {{ display: inline-block; background: #2563eb; color: white; padding: 12px 30px; text-decoration: none; border-radius: 8px; margin: 20px 0; }}
-        .footer {{ background: #f8fafc; padding: 20px; text-align: center; border-radius: 0 0 10px 10px; color: #6b7280; }}
+        body { font-family: Arial, sans-serif; line-height: 1.6; color: #333; }
+        .container { max-width: 600px; margin: 0 auto; padding: 20px; }
+        .header { background: linear-gradient(135deg, #059669, #047857); color: white; padding: 20px; text-align: center; border-radius: 10px 10px 0 0; }
+        .content { background: white; padding: 30px; border: 1px solid #e2e8f0; }
+        .welcome-box { background: #f0f9ff; border: 1px solid #0891b2; padding: 20px; border-radius: 10px; margin: 20px 0; }
+        .button { display: inline-block; background: #2563eb; color: white; padding: 12px 30px; text-decoration: none; border-radius: 8px; margin: 20px 0; }
+        .footer { background: #f8fafc; padding: 20px; text-align: center; border-radius: 0 0 10px 10px; color: #6b7280; }
     </style>
 </head>
 <body>
@@ -225,13 +228,13 @@ SFRS Team
         </div>
         
         <div class="content">
-            <h2>Hello {full_name}!</h2>
+            <h2>Hello $full_name!</h2>
             <p>Welcome to the Student Face Recognition System. Your admin account has been successfully created!</p>
             
             <div class="welcome-box">
                 <h3>Account Details:</h3>
-                <p><strong>Username:</strong> {username}</p>
-                <p><strong>Email:</strong> {to_email}</p>
+                <p><strong>Username:</strong> $username</p>
+                <p><strong>Email:</strong> $to_email</p>
                 <p><strong>Role:</strong> Administrator</p>
             </div>
             
@@ -257,15 +260,627 @@ SFRS Team
     </div>
 </body>
 </html>
-        """
+        """))
+
+def _byte_skeleton(template):
+    """Pre-encode a template's static text as UTF-8 chunks split around its $fields"""
+    parts = re.split(r'\$(\w+)', template.template)
+    return [part.encode('utf-8') for part in parts[0::2]], parts[1::2]
+
+def _fill_skeleton(skeleton, **values):
+    """Render a byte skeleton; only the substituted values are encoded per call"""
+    chunks, names = skeleton
+    out = [chunks[0]]
+    for name, chunk in zip(names, chunks[1:]):
+        out.append(values[name].encode('utf-8'))
+        out.append(chunk)
+    return b''.join(out)
+
+# The HTML bodies are ~3KB of constant markup around a few fields
+_OTP_HTML_BYTES = _byte_skeleton(_OTP_HTML_TMPL)
+_WELCOME_HTML_BYTES = _byte_skeleton(_WELCOME_HTML_TMPL)
+
+class PipeliningSMTP(smtplib.SMTP):
+    """SMTP client using the PIPELINING and CHUNKING (BDAT) extensions when the server offers them"""
+    
+    def _get_socket(self, host, port, timeout):
+        # Every SMTP command is a small write waiting on a reply; don't let Nagle hold it back
+        sock = super()._get_socket(host, port, timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+    
+    def send_message(self, msg, from_addr=None, to_addrs=None, mail_options=(), rcpt_options=()):
+        self.ehlo_or_helo_if_needed()
+        eight_bit = [part for part in msg.walk() if part.get('Content-Transfer-Encoding') == '8bit']
+        if eight_bit:
+            if self.has_extn('8bitmime'):
+                addrs = [from_addr or ''] + ([to_addrs] if isinstance(to_addrs, str) else list(to_addrs or []))
+                # Non-ASCII addresses make smtplib add SMTPUTF8 and BODY=8BITMIME itself
+                if all(addr.isascii() for addr in addrs) and 'BODY=8BITMIME' not in mail_options:
+                    mail_options = (*mail_options, 'BODY=8BITMIME')
+            else:
+                # Old servers only take 7-bit bodies
+                for part in eight_bit:
+                    del part['Content-Transfer-Encoding']
+                    encoders.encode_base64(part)
+        return super().send_message(msg, from_addr, to_addrs, mail_options, rcpt_options)
+    
+    def sendmail(self, from_addr, to_addrs, msg, mail_options=(), rcpt_options=()):
+        self.ehlo_or_helo_if_needed()
+        pipelining = self.has_extn('pipelining')
+        chunking = self.has_extn('chunking')
+        if not (pipelining or chunking):
+            return super().sendmail(from_addr, to_addrs, msg, mail_options, rcpt_options)
+        
+        if isinstance(to_addrs, str):
+            to_addrs = [to_addrs]
+        if isinstance(msg, str):
+            msg = msg.encode('ascii')
+        msg = re.sub(br'(?:\r\n|\n|\r(?!\n))', b'\r\n', msg)
+        if not msg.endswith(b'\r\n'):
+            msg += b'\r\n'
+        mail_options = list(mail_options)
+        if self.has_extn('size'):
+            mail_options.append(f"size={len(msg)}")
+        
+        # With CHUNKING the body goes out as one sized BDAT chunk, with no
+        # dot-stuffing pass over it and no wait for a 354 go-ahead
+        chunk = b'BDAT %d LAST\r\n' % len(msg) + msg if chunking else None
         
-        return self.send_email(
-            to_email=to_email,
-            subject=subject,
-            body=text_body,
-            html_body=html_body,
-            from_name="SFRS Admin"
+        if pipelining:
+            # One write for the whole envelope (and BDAT body), then read the replies back in order
+            def command(verb, address, options):
+                optionlist = ' ' + ' '.join(options) if options else ''
+                return f"{verb}:{smtplib.quoteaddr(address)}{optionlist}\r\n"
+            
+            commands = [command('MAIL FROM', from_addr, mail_options)]
+            commands += [command('RCPT TO', addr, rcpt_options) for addr in to_addrs]
+            if not chunking:
+                commands.append('DATA\r\n')
+            self.send(''.join(commands).encode(self.command_encoding) + (chunk or b''))
+            
+            mail_reply = self.getreply()
+            refused = {}
+            for addr in to_addrs:
+                code, resp = self.getreply()
+                if code not in (250, 251):
+                    refused[addr] = (code, resp)
+        else:
+            mail_reply = self.mail(from_addr, mail_options)
+            if mail_reply[0] != 250:
+                self._rset()
+                raise smtplib.SMTPSenderRefused(mail_reply[0], mail_reply[1], from_addr)
+            refused = {}
+            for addr in to_addrs:
+                code, resp = self.rcpt(addr, rcpt_options)
+                if code not in (250, 251):
+                    refused[addr] = (code, resp)
+            if len(refused) == len(to_addrs):
+                self._rset()
+                raise smtplib.SMTPRecipientsRefused(refused)
+            self.send(chunk)
+        
+        last_code, last_resp = self.getreply()
+        
+        if not chunking and last_code == 354 and (mail_reply[0] != 250 or len(refused) == len(to_addrs)):
+            # The server is waiting for a body we are not going to send
+            self.send(b'.\r\n')
+            self.getreply()
+        if mail_reply[0] != 250:
+            self._rset()
+            raise smtplib.SMTPSenderRefused(mail_reply[0], mail_reply[1], from_addr)
+        if len(refused) == len(to_addrs):
+            self._rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+        
+        if not chunking:
+            if last_code != 354:
+                self._rset()
+                raise smtplib.SMTPDataError(last_code, last_resp)
+            self.send(re.sub(br'(?m)^\.', b'..', msg) + b'.\r\n')
+            last_code, last_resp = self.getreply()
+        if last_code != 250:
+            self._rset()
+            raise smtplib.SMTPDataError(last_code, last_resp)
+        return refused
+
+class PipeliningSMTP_SSL(PipeliningSMTP, smtplib.SMTP_SSL):
+    """PipeliningSMTP over implicit TLS (port 465)"""
+
+class EmailService:
+    """Email service class supporting multiple providers"""
+    
+    def __init__(self, provider='gmail', pool_size=5, max_messages_per_connection=100, **kwargs):
+        self.provider = provider.lower()
+        self.config = self._get_config(provider, **kwargs)
+        # Hot-path settings as plain attributes rather than dict lookups per send
+        self._host = self.config['smtp_server']
+        self._port = self.config['smtp_port']
+        self._user = self.config['username']
+        self._pw = self.config['password']
+        self._use_ssl = self.config['use_ssl']
+        # STARTTLS only applies to plaintext connections
+        self._use_tls = self.config['use_tls'] and not self._use_ssl
+        self._msgid_domain = self._user.rpartition('@')[2] or None
+        # Up to pool_size authenticated sessions, each recycled after
+        # max_messages_per_connection messages to stay under provider limits
+        self.max_messages_per_connection = max_messages_per_connection
+        self._idle, self._slots = _get_pool(
+            (self._host, self._port, self._user),
+            pool_size
         )
+        self.pool_size = pool_size
+        # aiosmtplib connections belong to one event loop, so each loop gets its own pool
+        self._async_pools = weakref.WeakKeyDictionary()
+        
+    def _get_config(self, provider, **kwargs):
+        """Get configuration for different email providers"""
+        factory = _PROVIDERS.get(provider)
+        if factory is None:
+            raise ValueError(f"Unsupported email provider: {provider}")
+        
+        _load_env()
+        config = factory(kwargs)
+        
+        # Validate required fields
+        if not config['username'] or not config['password']:
+            raise ValueError(f"Username and password required for {provider}")
+            
+        return config
+    
+    def _connect(self):
+        """Open and authenticate a new SMTP session"""
+        if self._use_ssl:
+            server = PipeliningSMTP_SSL(self._host, self._port,
+                                        timeout=SMTP_TIMEOUT, context=_SSL_CONTEXT)
+        else:
+            server = PipeliningSMTP(self._host, self._port, timeout=SMTP_TIMEOUT)
+        
+        if self._use_tls:
+            server.starttls(context=_SSL_CONTEXT)
+        
+        server.login(self._user, self._pw)
+        return server
+    
+    def _acquire(self):
+        """Take a live (connection, messages_sent) pair from the pool, opening one if none are idle"""
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    server, count = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect(), 0
+                try:
+                    if server.noop()[0] == 250:
+                        return server, count
+                except (smtplib.SMTPException, OSError):
+                    pass
+                self._drop(server)
+        except BaseException:
+            self._slots.release()
+            raise
+    
+    def _release(self, server, count, broken=False):
+        """Return a connection to the pool, or retire it once broken or worn out"""
+        try:
+            if broken:
+                self._drop(server)
+            elif count >= self.max_messages_per_connection:
+                self._quit(server)
+            else:
+                self._idle.put_nowait((server, count))
+        finally:
+            self._slots.release()
+    
+    @staticmethod
+    def _drop(server):
+        """Close a connection without waiting on a server that may be gone"""
+        try:
+            server.close()
+        except OSError:
+            pass
+    
+    @classmethod
+    def _quit(cls, server):
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            cls._drop(server)
+    
+    def close(self):
+        """Politely end every idle pooled session"""
+        _close_idle(self._idle)
+    
+    def _build_message(self, recipients, subject, body, html_body=None, from_name=None):
+        """Build a MIME message, multipart/alternative when an HTML body (str or UTF-8 bytes) is given"""
+        msg = EmailMessage()
+        msg['From'] = formataddr((from_name, self._user)) if from_name else self._user
+        msg['To'] = ', '.join(recipients)
+        msg['Subject'] = subject
+        msg['Date'] = formatdate(localtime=True)
+        msg['Message-ID'] = make_msgid(domain=self._msgid_domain)
+        
+        msg.set_content(body)
+        if isinstance(html_body, bytes):
+            # Already UTF-8; carried as-is instead of being re-encoded
+            msg.add_alternative(html_body, 'text', 'html', cte='8bit', params={'charset': 'utf-8'})
+        elif html_body:
+            msg.add_alternative(html_body, subtype='html')
+        return msg
+    
+    @staticmethod
+    def _is_broken(error):
+        """Whether a send error means the connection itself is unusable"""
+        if isinstance(error, smtplib.SMTPServerDisconnected):
+            return True
+        if isinstance(error, smtplib.SMTPResponseException):
+            return error.smtp_code == 421
+        # Refused recipients and the like leave the session intact; any other
+        # OSError is a socket failure (SMTPException subclasses OSError)
+        return not isinstance(error, smtplib.SMTPException)
+    
+    @staticmethod
+    def _is_transient(error):
+        """Whether the server answered with a 4xx "try again later" rather than a permanent 5xx"""
+        if isinstance(error, smtplib.SMTPResponseException):
+            return 400 <= error.smtp_code < 500
+        if isinstance(error, smtplib.SMTPRecipientsRefused):
+            return all(400 <= code < 500 for code, _ in error.recipients.values())
+        return False
+    
+    def send_email(self, to_email: Union[str, List[str]], subject: str, body: str, 
+                   html_body: Optional[str] = None, 
+                   from_name: Optional[str] = None) -> bool:
+        """Send email with optional HTML body to one address or a list of addresses"""
+        recipients = [to_email] if isinstance(to_email, str) else list(to_email)
+        invalid = [addr for addr in recipients if not _EMAIL_RE.match(addr)]
+        if invalid or not recipients:
+            logger.warning("Email not sent, invalid recipient address: %s", invalid)
+            return False
+        
+        try:
+            msg = self._build_message(recipients, subject, body, html_body, from_name)
+            
+            # Reuse a pooled session instead of a fresh connect/TLS/login per message.
+            # A dropped or timed-out (421) session is replaced and the send retried
+            # at once; other 4xx replies are retried with exponential backoff, 5xx never.
+            reconnected = False
+            retries = 0
+            while True:
+                server, count = self._acquire()
+                broken = False
+                delay = None
+                try:
+                    server.send_message(msg, self._user, recipients)
+                    count += 1
+                    break
+                except OSError as e:
+                    broken = self._is_broken(e)
+                    if broken and not reconnected:
+                        reconnected = True
+                    elif self._is_transient(e) and retries < SMTP_RETRIES:
+                        delay = 2 ** retries
+                        retries += 1
+                        logger.warning("Temporary SMTP failure (%s), retrying in %ds", e, delay)
+                    else:
+                        raise
+                finally:
+                    self._release(server, count, broken)
+                if delay:
+                    time.sleep(delay)
+            
+            logger.info("Email sent successfully to %s", to_email)
+            return True
+            
+        except Exception as e:
+            logger.error("Email sending failed: %s", e)
+            return False
+    
+    def send_email_background(self, *args, **kwargs) -> Future:
+        """Queue send_email on the shared worker pool; the Future resolves to its result"""
+        return _executor.submit(self.send_email, *args, **kwargs)
+    
+    async def send_email_async(self, to_email: Union[str, List[str]], subject: str, body: str,
+                               html_body: Optional[str] = None,
+                               from_name: Optional[str] = None) -> bool:
+        """Awaitable send_email for asyncio callers
+        
+        Uses aiosmtplib connections pooled per event loop when it is installed,
+        otherwise runs the blocking send_email on the shared worker pool.
+        """
+        if aiosmtplib is None:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                _executor, lambda: self.send_email(to_email, subject, body, html_body, from_name)
+            )
+        
+        recipients = [to_email] if isinstance(to_email, str) else list(to_email)
+        if not recipients or not all(_EMAIL_RE.match(addr) for addr in recipients):
+            logger.warning("Email not sent, invalid recipient address: %s", to_email)
+            return False
+        
+        try:
+            msg = self._build_message(recipients, subject, body, html_body, from_name)
+            
+            for attempt in range(2):
+                smtp, count = await self._async_acquire()
+                broken = False
+                try:
+                    await smtp.send_message(msg, sender=self._user, recipients=recipients)
+                    count += 1
+                    break
+                except aiosmtplib.SMTPServerDisconnected:
+                    broken = True
+                    if attempt:
+                        raise
+                except aiosmtplib.SMTPResponseException as e:
+                    broken = e.code == 421
+                    if attempt or not broken:
+                        raise
+                finally:
+                    await self._async_release(smtp, count, broken)
+            
+            logger.info("Email sent successfully to %s", to_email)
+            return True
+            
+        except Exception as e:
+            logger.error("Email sending failed: %s", e)
+            return False
+    
+    def _async_pool(self):
+        loop = asyncio.get_running_loop()
+        pool = self._async_pools.get(loop)
+        if pool is None:
+            pool = self._async_pools[loop] = ([], asyncio.Semaphore(self.pool_size))
+        return pool
+    
+    async def _async_acquire(self):
+        """Async counterpart of _acquire for aiosmtplib connections"""
+        idle, slots = self._async_pool()
+        await slots.acquire()
+        try:
+            while idle:
+                smtp, count = idle.pop()
+                if smtp.is_connected:
+                    return smtp, count
+            smtp = aiosmtplib.SMTP(
+                hostname=self._host,
+                port=self._port,
+                username=self._user,
+                password=self._pw,
+                use_tls=self._use_ssl,
+                start_tls=self._use_tls,
+                tls_context=_SSL_CONTEXT,
+                timeout=SMTP_TIMEOUT,
+            )
+            await smtp.connect()
+            return smtp, 0
+        except BaseException:
+            slots.release()
+            raise
+    
+    async def _async_release(self, smtp, count, broken=False):
+        idle, slots = self._async_pool()
+        try:
+            if broken:
+                smtp.close()
+            elif count >= self.max_messages_per_connection:
+                try:
+                    await smtp.quit()
+                except aiosmtplib.SMTPException:
+                    smtp.close()
+            else:
+                idle.append((smtp, count))
+        finally:
+            slots.release()
+    
+    def send_bulk(self, messages: List[dict],
+                  transient_failures: Optional[List[int]] = None) -> List[bool]:
+        """Send many emails over one pooled session; returns a success flag per message
+        
+        Each item takes the same keyword arguments as send_email. The batch is
+        abandoned once 30+ messages have been tried and over a third failed.
+        If transient_failures is given, indices of messages refused with a 4xx
+        are appended to it so the caller can retry them later.
+        """
+        results = [False] * len(messages)
+        failed = 0
+        server = None
+        count = 0
+        broken = False
+        try:
+            for i, message in enumerate(messages):
+                if server is not None and (broken or count >= self.max_messages_per_connection):
+                    # Replace a session that died on the last message, or recycle
+                    # before the provider starts dropping a long-lived one
+                    self._release(server, count, broken)
+                    server = None
+                    broken = False
+                if server is None:
+                    server, count = self._acquire()
+                
+                to_email = message['to_email']
+                recipients = [to_email] if isinstance(to_email, str) else list(to_email)
+                if not recipients or not all(_EMAIL_RE.match(addr) for addr in recipients):
+                    logger.warning("Email not sent, invalid recipient address: %s", to_email)
+                    continue
+                msg = self._build_message(
+                    recipients, message['subject'], message['body'],
+                    message.get('html_body'), message.get('from_name')
+                )
+                
+                for attempt in range(2):
+                    try:
+                        server.send_message(msg, self._user, recipients)
+                        count += 1
+                        results[i] = True
+                        broken = False
+                        break
+                    except OSError as e:
+                        broken = self._is_broken(e)
+                        if attempt or not broken:
+                            logger.error("Email sending failed: %s", e)
+                            if transient_failures is not None and self._is_transient(e):
+                                transient_failures.append(i)
+                            break
+                        self._release(server, count, broken)
+                        server = None
+                        broken = False
+                        server, count = self._acquire()
+                
+                if not results[i]:
+                    failed += 1
+                    if i + 1 >= 30 and failed * 3 > i + 1:
+                        logger.error("Aborting bulk send after %d of %d messages failed", failed, i + 1)
+                        break
+            
+        except Exception as e:
+            logger.error("Bulk email sending failed: %s", e)
+        finally:
+            if server is not None:
+                self._release(server, count, broken)
+        
+        logger.info("Bulk send delivered %d of %d emails", sum(results), len(messages))
+        return results
+    
+    @staticmethod
+    def _otp_message(to_email, otp, purpose):
+        """send_email arguments for an OTP email"""
+        return {
+            'to_email': to_email,
+            'subject': f"Your OTP Code for {purpose.title()}",
+            'body': _OTP_TEXT_TMPL.substitute(otp=otp, purpose=purpose),
+            'html_body': _fill_skeleton(_OTP_HTML_BYTES, otp=otp, purpose=purpose),
+            'from_name': "SFRS Admin",
+        }
+    
+    @staticmethod
+    def _welcome_message(to_email, full_name, username):
+        """send_email arguments for a welcome email"""
+        return {
+            'to_email': to_email,
+            'subject': "Welcome to Student Face Recognition System",
+            'body': _WELCOME_TEXT_TMPL.substitute(full_name=full_name, username=username, to_email=to_email),
+            'html_body': _fill_skeleton(_WELCOME_HTML_BYTES, full_name=full_name, username=username, to_email=to_email),
+            'from_name': "SFRS Admin",
+        }
+    
+    def send_otp_email(self, to_email: str, otp: str, purpose: str = 'verification') -> bool:
+        """Send OTP email with formatted template"""
+        return self.send_email(**self._otp_message(to_email, otp, purpose))
+    
+    def send_welcome_email(self, to_email: str, full_name: str, username: str) -> bool:
+        """Send welcome email to new admin users"""
+        return self.send_email(**self._welcome_message(to_email, full_name, username))
+    
+    def enqueue_email(self, message: dict) -> bool:
+        """Hand a send_email-style message to the background sender; False if the queue is full"""
+        _ensure_mail_worker()
+        try:
+            _MAIL_Q.put((self, message, 0), timeout=MAIL_QUEUE_PUT_TIMEOUT)
+        except queue.Full:
+            logger.warning("Email queue full, dropping message to %s", message['to_email'])
+            return False
+        return True
+    
+    def enqueue_otp_email(self, to_email: str, otp: str, purpose: str = 'verification') -> bool:
+        """Queue an OTP email and return without waiting on SMTP"""
+        return self.enqueue_email(self._otp_message(to_email, otp, purpose))
+    
+    def enqueue_welcome_email(self, to_email: str, full_name: str, username: str) -> bool:
+        """Queue a welcome email and return without waiting on SMTP"""
+        return self.enqueue_email(self._welcome_message(to_email, full_name, username))
+
+def _close_idle(idle):
+    while True:
+        try:
+            server, _ = idle.get_nowait()
+        except queue.Empty:
+            return
+        EmailService._quit(server)
+
+@atexit.register
+def _close_pools():
+    """Politely end the idle sessions of every pool at interpreter exit"""
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+    for idle, _ in pools:
+        _close_idle(idle)
+
+# Fire-and-forget delivery: a daemon thread drains the queue in small batches,
+# so bursts share pooled connections via send_bulk
+_MAIL_Q = queue.Queue(maxsize=1000)
+MAIL_QUEUE_PUT_TIMEOUT = 0.5  # Shed load rather than stall the caller when the queue is full
+MAIL_BATCH_SIZE = 32
+MAIL_BATCH_WAIT = 0.1
+MAIL_MAX_RETRIES = 5  # Queued messages refused with a 4xx are retried after 1, 2, 4, 8, 16s
+_mail_worker = None
+_mail_worker_lock = threading.Lock()
+
+def _drain_mail_queue():
+    while True:
+        batch = [_MAIL_Q.get()]
+        deadline = time.monotonic() + MAIL_BATCH_WAIT
+        while len(batch) < MAIL_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_MAIL_Q.get(timeout=remaining))
+            except queue.Empty:
+                break
+        
+        by_service = {}
+        for service, message, attempt in batch:
+            by_service.setdefault(service, []).append((message, attempt))
+        for service, items in by_service.items():
+            transient = []
+            try:
+                service.send_bulk([message for message, _ in items], transient)
+            except Exception as e:
+                logger.error("Queued email batch failed: %s", e)
+            for i in transient:
+                message, attempt = items[i]
+                if attempt < MAIL_MAX_RETRIES:
+                    _retry_later(service, message, attempt + 1)
+                else:
+                    logger.error("Giving up on email to %s after %d retries", message['to_email'], attempt)
+
+def _retry_later(service, message, attempt):
+    """Put a message back on the queue after an exponential backoff delay"""
+    def requeue():
+        try:
+            _MAIL_Q.put_nowait((service, message, attempt))
+        except queue.Full:
+            logger.warning("Email queue full, dropping retry to %s", message['to_email'])
+    timer = threading.Timer(2 ** (attempt - 1), requeue)
+    timer.daemon = True
+    timer.start()
+
+def _ensure_mail_worker():
+    global _mail_worker
+    if _mail_worker is None:
+        with _mail_worker_lock:
+            if _mail_worker is None:
+                _mail_worker = threading.Thread(target=_drain_mail_queue, name='email-queue', daemon=True)
+                _mail_worker.start()
+
+# One shared service per provider, so its pooled connections outlive any single request
+_SERVICES = {}
+_SERVICES_LOCK = threading.Lock()
+
+def get_default_service(provider='gmail'):
+    """Return the process-wide EmailService for a provider, creating it on first use
+    
+    Prefer this over constructing EmailService directly; a fresh instance per
+    request would log in to the SMTP server again every time.
+    """
+    provider = provider.lower()
+    with _SERVICES_LOCK:
+        if provider not in _SERVICES:
+            _SERVICES[provider] = EmailService(provider=provider)
+        return _SERVICES[provider]
 
 # Configuration examples for different providers
 def get_email_service_examples():
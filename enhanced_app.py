@@ -1,7 +1,7 @@
 # Enhanced Student Face Registration System
 # Main application file: enhanced_app.py
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, g
 import cv2
 import numpy as np
 import os
@@ -9,6 +9,7 @@ import base64
 import sqlite3
 from datetime import datetime, timedelta
 import face_recognition
+import dlib
 from werkzeug.utils import secure_filename
 import json
 import hashlib
@@ -17,9 +18,34 @@ import random
 import string
 from functools import wraps
 import logging
+import multiprocessing
+import threading
+from collections import OrderedDict
+import queue
+import atexit
+import time
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
-from database import get_db_connection, init_enhanced_db, hash_password, verify_password
-from email_service import EmailService
+
+try:
+    import faiss
+except ImportError:  # Optional: matching falls back to a NumPy scan
+    faiss = None
+
+try:
+    import numba
+except ImportError:  # Optional: matching falls back to NumPy when faiss is absent too
+    numba = None
+
+try:
+    import redis
+except ImportError:  # Optional: verify results are simply not cached
+    redis = None
+
+from database import (get_db_connection, acquire_connection, release_connection, init_enhanced_db,
+                      migrate_database, hash_password, verify_password, encoding_to_blob,
+                      decode_encoding)
+from email_service import get_default_service
 
 # Load environment variables from .env file
 load_dotenv()
@@ -32,6 +58,38 @@ UPLOAD_FOLDER = 'static/student_photos'
 ENCODINGS_FOLDER = 'face_encodings'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 RECOGNITION_THRESHOLD = 0.6
+VERIFY_MAX_EDGE = 480  # Longest side (px) of verification images fed to the detector
+# Face detector: 'cnn' needs a CUDA build of dlib to be practical, 'hog' runs on the CPU
+FACE_MODEL = os.getenv('FACE_MODEL', 'cnn' if dlib.DLIB_USE_CUDA else 'hog')
+# Worker processes for face detection/encoding, kept off the request threads
+FACE_WORKERS = int(os.getenv('FACE_WORKERS', os.cpu_count() or 1))
+# Verify results are cached in Redis by image hash when REDIS_URL is set
+REDIS_URL = os.getenv('REDIS_URL')
+VERIFY_CACHE_TTL = 300  # Seconds
+VERIFY_CACHE_GENERATION_KEY = 'verify:generation'
+# Galleries at least this large use an inverted-file FAISS index instead of a flat one
+FAISS_IVF_MIN_SIZE = 10000
+FAISS_IVF_NPROBE = 8
+# Without FAISS, galleries at least this large are pre-filtered with int8 distances
+INT8_MIN_SIZE = 4096
+INT8_CANDIDATES = 20  # Rows re-scored in float32 after the int8 pre-filter
+
+# In-memory gallery: row i of 'M' belongs to students.id ids[i]. 'M' is a
+# 64-byte aligned, C-contiguous (N, 128) float32 matrix, None until first load.
+# 'index' is a FAISS index over the same rows when faiss is installed.
+# 'M_i8' is M quantized to int8 with one shared 'scale', so int8 distances
+# between rows stay comparable; it is only kept when numba is installed.
+_enc_cache = {
+    'M': None,
+    'sq_norms': None,
+    'M_i8': None,
+    'scale': 1.0,
+    'ids': [],
+    'index': None,
+    'lock': threading.Lock(),
+}
+
+_redis = redis.Redis.from_url(REDIS_URL) if redis is not None and REDIS_URL else None
 
 # Email Configuration
 EMAIL_PROVIDER = os.getenv('EMAIL_PROVIDER', 'gmail')  # gmail, outlook, yahoo, custom
@@ -39,7 +97,7 @@ EMAIL_SERVICE = None
 
 # Initialize email service
 try:
-    EMAIL_SERVICE = EmailService(provider=EMAIL_PROVIDER)
+    EMAIL_SERVICE = get_default_service(EMAIL_PROVIDER)
     logging.info(f"Email service initialized with provider: {EMAIL_PROVIDER}")
 except Exception as e:
     logging.warning(f"Email service initialization failed: {str(e)}")
@@ -59,6 +117,22 @@ logging.basicConfig(
     format='%(asctime)s %(levelname)s %(name)s %(message)s'
 )
 
+if not dlib.DLIB_USE_BLAS:
+    logging.warning("dlib was built without BLAS; face encoding will be slow (see DEPLOYMENT_GUIDE.md)")
+
+def get_db():
+    """Return the connection for the current request, taking one from the pool on first use"""
+    db = getattr(g, '_db', None)
+    if db is None:
+        db = g._db = acquire_connection()
+    return db
+
+@app.teardown_appcontext
+def close_db(exception):
+    db = g.pop('_db', None)
+    if db is not None:
+        release_connection(db)
+
 def login_required(f):
     """Decorator to require login"""
     @wraps(f)
@@ -75,11 +149,10 @@ def admin_required(f):
         if 'admin_id' not in session:
             return redirect(url_for('login'))
         
-        conn = get_db_connection()
+        conn = get_db()
         admin = conn.execute(
             'SELECT role FROM admins WHERE id = ?', (session['admin_id'],)
         ).fetchone()
-        conn.close()
         
         if not admin or admin['role'] not in ['admin', 'super_admin']:
             flash('Access denied. Admin privileges required.', 'error')
@@ -95,10 +168,13 @@ def generate_otp():
     return ''.join(random.choices(string.digits, k=6))
 
 def send_email(to_email, subject, body):
-    """Send email using configured email service"""
+    """Queue an email on the configured email service"""
     try:
         if EMAIL_SERVICE:
-            return EMAIL_SERVICE.send_email(to_email, subject, body)
+            # Sent by the background mail queue so the request doesn't wait on SMTP
+            return EMAIL_SERVICE.enqueue_email(
+                {'to_email': to_email, 'subject': subject, 'body': body}
+            )
         else:
             # Fallback: just log the email
             logging.info(f"Email service not configured. Would send to {to_email}: {subject} - {body}")
@@ -111,7 +187,8 @@ def send_otp_email(to_email, otp, purpose='verification'):
     """Send OTP email with formatted template"""
     try:
         if EMAIL_SERVICE:
-            return EMAIL_SERVICE.send_otp_email(to_email, otp, purpose)
+            # Queued for the background sender so the request doesn't wait on SMTP
+            return EMAIL_SERVICE.enqueue_otp_email(to_email, otp, purpose)
         else:
             # Fallback: just log the OTP
             logging.info(f"EMAIL SERVICE NOT CONFIGURED - OTP for {to_email}: {otp}")
@@ -120,21 +197,390 @@ def send_otp_email(to_email, otp, purpose='verification'):
         logging.error(f"OTP email sending failed: {str(e)}")
         return False
 
+# Recognition logs are written in batches by a background thread
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 200
+LOG_BATCH_WAIT = 0.5  # Seconds to wait for more rows before writing a batch
+LOG_FLUSH_TIMEOUT = 5  # Seconds to wait at exit for the writer's last batch
+_LOG_STOP = object()  # Queued at exit to tell the writer to finish up
+_log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_log_worker = None
+_log_worker_lock = threading.Lock()
+
+_INSERT_LOG_SQL = '''
+    INSERT INTO recognition_logs 
+    (student_id, recognition_type, success, confidence_score, method, 
+     ip_address, user_agent, session_id, verified_by, notes)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def _write_logs(conn, rows):
+    with conn:
+        conn.executemany(_INSERT_LOG_SQL, rows)
+
+def _drain_log_queue():
+    conn = get_db_connection()
+    stopping = False
+    while not stopping:
+        row = _log_queue.get()
+        if row is _LOG_STOP:
+            break
+        rows = [row]
+        deadline = time.monotonic() + LOG_BATCH_WAIT
+        while len(rows) < LOG_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                row = _log_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if row is _LOG_STOP:
+                stopping = True
+                break
+            rows.append(row)
+        try:
+            _write_logs(conn, rows)
+        except Exception as e:
+            logging.error(f"Writing {len(rows)} recognition logs failed: {str(e)}")
+    conn.close()
+
+def _ensure_log_worker():
+    global _log_worker
+    if _log_worker is None:
+        with _log_worker_lock:
+            if _log_worker is None:
+                _log_worker = threading.Thread(target=_drain_log_queue, name='recognition-logs', daemon=True)
+                _log_worker.start()
+
+def _write_logs_separately(rows):
+    """Write rows on a connection of their own, leaving the request's transaction alone"""
+    conn = get_db_connection()
+    try:
+        _write_logs(conn, rows)
+    finally:
+        conn.close()
+
+@atexit.register
+def _flush_log_queue():
+    """Let the writer commit its in-flight batch, then write whatever is still queued"""
+    if _log_worker is not None and _log_worker.is_alive():
+        try:
+            _log_queue.put(_LOG_STOP, timeout=LOG_FLUSH_TIMEOUT)
+        except queue.Full:
+            pass
+        _log_worker.join(timeout=LOG_FLUSH_TIMEOUT)
+    rows = []
+    while True:
+        try:
+            row = _log_queue.get_nowait()
+        except queue.Empty:
+            break
+        if row is not _LOG_STOP:
+            rows.append(row)
+    if rows:
+        _write_logs_separately(rows)
+
 def log_recognition_attempt(student_id, success, confidence_score, method, notes=None):
     """Log face recognition attempts"""
-    conn = get_db_connection()
-    conn.execute('''
-        INSERT INTO recognition_logs 
-        (student_id, recognition_type, success, confidence_score, method, 
-         ip_address, user_agent, session_id, verified_by, notes)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
+    row = (
         student_id, 'verification', success, confidence_score, method,
         request.remote_addr, request.headers.get('User-Agent'),
         session.get('session_id'), session.get('admin_id'), notes
-    ))
-    conn.commit()
+    )
+    _ensure_log_worker()
+    try:
+        _log_queue.put_nowait(row)
+    except queue.Full:
+        # Writer has fallen behind; insert directly rather than drop the row
+        _write_logs_separately([row])
+
+_face_pool = None
+_face_pool_lock = threading.Lock()
+
+def get_face_pool():
+    """Return the shared process pool used for face encoding"""
+    global _face_pool
+    if _face_pool is None:
+        with _face_pool_lock:
+            if _face_pool is None:
+                # Forking once the log and mail threads are running can hand a child a
+                # lock that is held forever, so workers start from a clean process
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                _face_pool = ProcessPoolExecutor(max_workers=FACE_WORKERS,
+                                                 mp_context=multiprocessing.get_context(method))
+    return _face_pool
+
+def downscale_image(image, max_edge):
+    """Shrink an image so its longest side is at most max_edge pixels"""
+    scale = max_edge / max(image.shape[:2])
+    if scale < 1:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return image
+
+def encode_faces(image):
+    """Detect faces with FACE_MODEL and return their 128-d encodings"""
+    locations = face_recognition.face_locations(image, model=FACE_MODEL)
+    return face_recognition.face_encodings(image, known_face_locations=locations, num_jitters=0)
+
+def encode_faces_in_bytes(image_bytes, max_edge=None):
+    """Return the face encodings found in encoded image bytes (runs in a worker process)"""
+    bgr = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if bgr is None:
+        return []
+    if max_edge:
+        bgr = downscale_image(bgr, max_edge)
+    return encode_faces(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB))
+
+def encode_faces_in_file(image_path, max_edge=None):
+    """Return the face encodings found in an image file (runs in a worker process)"""
+    image = face_recognition.load_image_file(image_path)
+    if max_edge:
+        image = downscale_image(image, max_edge)
+    return encode_faces(image)
+
+# Recent verification encodings per (session, image digest), least recently used first
+PROBE_CACHE_SIZE = 1024
+_probe_cache = OrderedDict()
+_probe_cache_lock = threading.Lock()
+
+def get_probe_encodings(image_bytes):
+    """Encode a verification image, reusing the result for a repeated frame in the same session"""
+    key = (session.get('session_id'), hashlib.blake2b(image_bytes, digest_size=16).digest())
+    with _probe_cache_lock:
+        if key in _probe_cache:
+            _probe_cache.move_to_end(key)
+            return _probe_cache[key]
+    
+    # Decode in memory and encode in a worker process
+    encodings = get_face_pool().submit(encode_faces_in_bytes, image_bytes, VERIFY_MAX_EDGE).result()
+    with _probe_cache_lock:
+        _probe_cache[key] = encodings
+        if len(_probe_cache) > PROBE_CACHE_SIZE:
+            _probe_cache.popitem(last=False)
+    return encodings
+
+def build_faiss_index(vectors):
+    """Build a FAISS L2 index over (N, 128) float32 vectors"""
+    n = len(vectors)
+    if n < FAISS_IVF_MIN_SIZE:
+        index = faiss.IndexFlatL2(128)
+    else:
+        nlist = int(np.sqrt(n))
+        index = faiss.IndexIVFFlat(faiss.IndexFlatL2(128), 128, nlist)
+        index.train(vectors)
+        index.nprobe = FAISS_IVF_NPROBE
+    index.add(vectors)
+    return index
+
+def aligned_empty(shape, dtype=np.float32, alignment=64):
+    """Allocate an uninitialised C-contiguous array whose data starts on an alignment boundary"""
+    nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    buf = np.empty(nbytes + alignment, dtype=np.uint8)
+    offset = -buf.ctypes.data % alignment
+    return buf[offset:offset + nbytes].view(dtype).reshape(shape)
+
+def reload_encodings():
+    """Load every stored face encoding into the in-memory gallery"""
+    conn = get_db_connection()
+    rows = conn.execute(
+        'SELECT id, face_encoding FROM students WHERE face_encoding IS NOT NULL'
+    ).fetchall()
     conn.close()
+    
+    ids = [row['id'] for row in rows]
+    matrix = aligned_empty((len(rows), 128))
+    for i, row in enumerate(rows):
+        matrix[i] = decode_encoding(row['face_encoding'])
+    
+    sq_norms = np.einsum('ij,ij->i', matrix, matrix)
+    index = None
+    if faiss is not None:
+        index = build_faiss_index(matrix)
+    scale = float(np.abs(matrix).max(initial=0)) / 127 or 1.0
+    matrix_i8 = quantize_encodings(matrix, scale) if numba is not None else None
+    with _enc_cache['lock']:
+        _enc_cache.update(M=matrix, sq_norms=sq_norms, M_i8=matrix_i8, scale=scale, ids=ids, index=index)
+
+def quantize_encodings(encodings, scale):
+    """Round float32 encodings to int8 in units of scale"""
+    return np.clip(np.rint(encodings / scale), -127, 127).astype(np.int8)
+
+def add_encoding(student_row_id, encoding):
+    """Append one newly stored encoding to the in-memory gallery"""
+    if _enc_cache['M'] is None:
+        reload_encodings()
+        return
+    
+    vector = np.asarray(encoding, dtype=np.float32)
+    with _enc_cache['lock']:
+        index = _enc_cache['index']
+        if index is not None:
+            # Searches may still be running against the old index
+            index = faiss.clone_index(index)
+            index.add(vector[None, :])
+        # Build new arrays so readers holding the old snapshot are unaffected
+        old = _enc_cache['M']
+        matrix = aligned_empty((len(old) + 1, 128))
+        matrix[:-1] = old
+        matrix[-1] = vector
+        matrix_i8 = _enc_cache['M_i8']
+        if matrix_i8 is not None:
+            # Keep the gallery's scale; values outside it are clipped
+            row_i8 = quantize_encodings(vector, _enc_cache['scale'])
+            matrix_i8 = np.concatenate([matrix_i8, row_i8[None, :]])
+        _enc_cache.update(
+            index=index,
+            M=matrix,
+            M_i8=matrix_i8,
+            sq_norms=np.append(_enc_cache['sq_norms'], np.dot(vector, vector)),
+            ids=_enc_cache['ids'] + [student_row_id],
+        )
+
+def get_encodings():
+    """Return a consistent (M, sq_norms, ids, index, M_i8, scale) snapshot of the gallery"""
+    if _enc_cache['M'] is None:
+        reload_encodings()
+    with _enc_cache['lock']:
+        return (_enc_cache['M'], _enc_cache['sq_norms'], _enc_cache['ids'], _enc_cache['index'],
+                _enc_cache['M_i8'], _enc_cache['scale'])
+
+def _best_match(matrix, sq_norms, v, max_sq):
+    """Index of and squared distance to the closest row under max_sq (-1 if none)"""
+    sq = sq_norms + np.dot(v, v) - 2 * (matrix @ v)
+    i = int(sq.argmin())
+    return (i, sq[i]) if sq[i] < max_sq else (-1, sq[i])
+
+if numba is not None:
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _best_match(matrix, sq_norms, v, max_sq):
+        n = matrix.shape[0]
+        chunks = numba.get_num_threads()
+        size = (n + chunks - 1) // chunks
+        best = np.full(chunks, max_sq, dtype=np.float32)
+        best_i = np.full(chunks, -1, dtype=np.int64)
+        # Each thread scans its own slice of rows; the winners are reduced below
+        for c in numba.prange(chunks):
+            for i in range(c * size, min(n, (c + 1) * size)):
+                s = 0.0
+                for k in range(matrix.shape[1]):
+                    d = matrix[i, k] - v[k]
+                    s += d * d
+                    # Partial sums only grow, so stop once this row can't win
+                    if s >= best[c]:
+                        break
+                if s < best[c]:
+                    best[c] = s
+                    best_i[c] = i
+        c = best.argmin()
+        return best_i[c], best[c]
+
+    @numba.njit(parallel=True, cache=True)
+    def _int8_sq_distances(matrix_i8, v_i8):
+        """Approximate squared distances, in quantized units, with int32 accumulation"""
+        out = np.empty(matrix_i8.shape[0], dtype=np.int32)
+        for i in numba.prange(matrix_i8.shape[0]):
+            s = np.int32(0)
+            for k in range(matrix_i8.shape[1]):
+                d = np.int32(matrix_i8[i, k]) - np.int32(v_i8[k])
+                s += d * d
+            out[i] = s
+        return out
+
+def find_best_match(encoding):
+    """Return (students.id, distance) of the nearest face within RECOGNITION_THRESHOLD, or (None, None)"""
+    known, sq_norms, student_ids, index, known_i8, scale = get_encodings()
+    if not len(student_ids):
+        return None, None
+    
+    if index is not None:
+        probe = np.asarray(encoding, dtype=np.float32).reshape(1, 128)
+        sq_distances, rows = index.search(probe, 1)
+        i, sq_distance = int(rows[0, 0]), sq_distances[0, 0]
+        if i < 0 or sq_distance >= RECOGNITION_THRESHOLD ** 2:
+            return None, None
+        return student_ids[i], float(np.sqrt(max(sq_distance, 0)))
+    
+    v = np.ascontiguousarray(encoding, dtype=np.float32)
+    if known_i8 is not None and len(student_ids) >= INT8_MIN_SIZE:
+        # Shortlist with int8 distances (a quarter of the memory traffic),
+        # then score only the shortlist exactly in float32
+        approx = _int8_sq_distances(known_i8, quantize_encodings(v, scale))
+        candidates = np.argpartition(approx, INT8_CANDIDATES)[:INT8_CANDIDATES]
+        j, sq_distance = _best_match(np.ascontiguousarray(known[candidates]), sq_norms[candidates], v,
+                                     np.float32(RECOGNITION_THRESHOLD ** 2))
+        i = int(candidates[j]) if j >= 0 else -1
+    else:
+        i, sq_distance = _best_match(known, sq_norms, v, np.float32(RECOGNITION_THRESHOLD ** 2))
+    if i < 0:
+        return None, None
+    return student_ids[i], float(np.sqrt(max(sq_distance, 0)))
+
+def get_cached_verification(image_bytes):
+    """Return (cache key, cached result or None) for a verification image"""
+    if _redis is None:
+        return None, None
+    try:
+        # The generation is bumped on enrollment, so older results stop matching
+        generation = (_redis.get(VERIFY_CACHE_GENERATION_KEY) or b'0').decode()
+        key = f"verify:{generation}:{hashlib.blake2b(image_bytes, digest_size=16).hexdigest()}"
+        cached = _redis.get(key)
+        return key, json.loads(cached) if cached else None
+    except redis.RedisError as e:
+        logging.warning(f"Verify cache unavailable: {str(e)}")
+        return None, None
+
+def cache_verification(key, result):
+    if key is None:
+        return
+    try:
+        _redis.setex(key, VERIFY_CACHE_TTL, json.dumps(result))
+    except redis.RedisError as e:
+        logging.warning(f"Verify cache unavailable: {str(e)}")
+
+def invalidate_verification_cache():
+    """Drop cached verify results after the gallery changes"""
+    if _redis is None:
+        return
+    try:
+        _redis.incr(VERIFY_CACHE_GENERATION_KEY)
+    except redis.RedisError as e:
+        logging.warning(f"Verify cache unavailable: {str(e)}")
+
+# Failed logins per (ip, username); checked before the slow scrypt verify
+LOGIN_MAX_FAILURES = 5
+LOGIN_THROTTLE_WINDOW = 60  # Seconds
+LOGIN_THROTTLE_MAX_KEYS = 10000
+# Insertion order is window-start order, so the oldest windows sit at the front
+_login_failures = OrderedDict()
+_login_failures_lock = threading.Lock()
+
+def login_throttled(key):
+    with _login_failures_lock:
+        entry = _login_failures.get(key)
+        if entry and time.monotonic() - entry[1] >= LOGIN_THROTTLE_WINDOW:
+            del _login_failures[key]
+            return False
+        return bool(entry) and entry[0] >= LOGIN_MAX_FAILURES
+
+def record_login_failure(key):
+    now = time.monotonic()
+    with _login_failures_lock:
+        entry = _login_failures.get(key)
+        if entry and now - entry[1] >= LOGIN_THROTTLE_WINDOW:
+            # Start a fresh window at the back of the queue
+            del _login_failures[key]
+            entry = None
+        if entry is None:
+            # Expired windows go first; past the cap evict only the oldest live
+            # one, so a flood of usernames can't reset everyone's counters
+            while _login_failures:
+                _, (_, start) = next(iter(_login_failures.items()))
+                if now - start < LOGIN_THROTTLE_WINDOW and len(_login_failures) < LOGIN_THROTTLE_MAX_KEYS:
+                    break
+                _login_failures.popitem(last=False)
+            entry = (0, now)
+        _login_failures[key] = (entry[0] + 1, entry[1])
 
 # Authentication Routes
 @app.route('/login', methods=['GET', 'POST'])
@@ -143,14 +589,20 @@ def login():
         username = request.form['username']
         password = request.form['password']
         
-        conn = get_db_connection()
+        throttle_key = (request.remote_addr, username)
+        if login_throttled(throttle_key):
+            flash('Too many failed login attempts. Please wait a minute and try again.', 'error')
+            return render_template('auth/login.html'), 429
+        
+        conn = get_db()
         admin = conn.execute(
             'SELECT * FROM admins WHERE username = ? AND is_active = 1',
             (username,)
         ).fetchone()
-        conn.close()
         
         if admin and verify_password(password, admin['password_hash']):
+            with _login_failures_lock:
+                _login_failures.pop(throttle_key, None)
             session['admin_id'] = admin['id']
             session['admin_name'] = admin['full_name']
             session['admin_role'] = admin['role']
@@ -158,17 +610,16 @@ def login():
             session['session_id'] = secrets.token_hex(16)
             
             # Update last login
-            conn = get_db_connection()
             conn.execute(
                 'UPDATE admins SET last_login = ? WHERE id = ?',
                 (datetime.now(), admin['id'])
             )
             conn.commit()
-            conn.close()
             
             flash('Login successful!', 'success')
             return redirect(url_for('dashboard'))
         else:
+            record_login_failure(throttle_key)
             flash('Invalid username or password', 'error')
     
     return render_template('auth/login.html')
@@ -183,13 +634,12 @@ def register():
         email = data['email']
         
         # Store OTP in database
-        conn = get_db_connection()
-        conn.execute('''
-            INSERT INTO otp_codes (email, otp_code, purpose, expires_at)
-            VALUES (?, ?, ?, ?)
-        ''', (email, otp, 'registration', datetime.now() + timedelta(minutes=10)))
-        conn.commit()
-        conn.close()
+        conn = get_db()
+        with conn:
+            conn.execute('''
+                INSERT INTO otp_codes (email, otp_code, purpose, expires_at)
+                VALUES (?, ?, ?, ?)
+            ''', (email, otp, 'registration', datetime.now() + timedelta(minutes=10)))
         
         # Send OTP email
         send_otp_email(email, otp, 'registration')
@@ -200,9 +650,8 @@ def register():
         return redirect(url_for('verify_otp', purpose='registration'))
     
     # Get colleges for dropdown
-    conn = get_db_connection()
+    conn = get_db()
     colleges = conn.execute('SELECT * FROM colleges WHERE status = "active"').fetchall()
-    conn.close()
     
     return render_template('auth/register.html', colleges=colleges)
 
@@ -212,7 +661,7 @@ def verify_otp(purpose):
         otp = request.form['otp']
         email = session.get('registration_data', {}).get('email')
         
-        conn = get_db_connection()
+        conn = get_db()
         otp_record = conn.execute('''
             SELECT * FROM otp_codes 
             WHERE email = ? AND otp_code = ? AND purpose = ? 
@@ -220,31 +669,34 @@ def verify_otp(purpose):
         ''', (email, otp, purpose, datetime.now())).fetchone()
         
         if otp_record:
-            # Mark OTP as used
-            conn.execute('UPDATE otp_codes SET used = 1 WHERE id = ?', (otp_record['id'],))
+            reg_data = session.get('registration_data') if purpose == 'registration' else None
+            # Hash before writing so the slow KDF doesn't run inside the write transaction
+            password_hash = hash_password(reg_data['password']) if reg_data else None
             
-            if purpose == 'registration':
-                # Complete registration
-                reg_data = session['registration_data']
-                password_hash = hash_password(reg_data['password'])
-                
-                conn.execute('''
-                    INSERT INTO admins (username, email, password_hash, full_name, role, college_id, phone)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    reg_data['username'], reg_data['email'], password_hash,
-                    reg_data['full_name'], 'admin', reg_data['college_id'], reg_data['phone']
-                ))
-                
+            # Claim the OTP and create the account in one transaction and one commit
+            with conn:
+                claimed = conn.execute(
+                    'UPDATE otp_codes SET used = 1 WHERE id = ? AND used = 0', (otp_record['id'],)
+                ).rowcount
+                if claimed and reg_data:
+                    # Complete registration
+                    conn.execute('''
+                        INSERT INTO admins (username, email, password_hash, full_name, role, college_id, phone)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ''', (
+                        reg_data['username'], reg_data['email'], password_hash,
+                        reg_data['full_name'], 'admin', reg_data['college_id'], reg_data['phone']
+                    ))
+            
+            if not claimed:
+                # Another request used this OTP between our SELECT and UPDATE
+                flash('Invalid or expired OTP', 'error')
+            elif reg_data:
                 flash('Registration successful! You can now login.', 'success')
                 session.pop('registration_data', None)
-                conn.commit()
-                conn.close()
                 return redirect(url_for('login'))
         else:
             flash('Invalid or expired OTP', 'error')
-        
-        conn.close()
     
     return render_template('auth/verify_otp.html', purpose=purpose)
 
@@ -256,17 +708,37 @@ def logout():
     return redirect(url_for('login'))
 
 # Dashboard and Main Routes
+DASHBOARD_CACHE_TTL = 30  # Seconds
+_dashboard_cache = {'expires': 0, 'stats': None, 'success_rate': None}
+
+def get_dashboard_stats(conn):
+    """Return (stats, success_rate) for the dashboard, recomputed at most every DASHBOARD_CACHE_TTL"""
+    now = time.monotonic()
+    if now >= _dashboard_cache['expires']:
+        row = conn.execute('''
+            SELECT
+                (SELECT COUNT(*) FROM students) AS total_students,
+                (SELECT COUNT(*) FROM colleges) AS total_colleges,
+                (SELECT COUNT(*) FROM departments) AS total_departments,
+                (SELECT COUNT(*) FROM exam_sessions) AS total_exams,
+                COUNT(*) AS total,
+                SUM(CASE WHEN success = 1 THEN 1 ELSE 0 END) AS successful
+            FROM recognition_logs
+            WHERE created_at >= date('now', '-7 days')
+        ''').fetchone()
+        _dashboard_cache.update(
+            expires=now + DASHBOARD_CACHE_TTL,
+            stats={key: row[key] for key in
+                   ('total_students', 'total_colleges', 'total_departments', 'total_exams')},
+            success_rate={'total': row['total'], 'successful': row['successful']},
+        )
+    return _dashboard_cache['stats'], _dashboard_cache['success_rate']
+
 @app.route('/')
 @login_required
 def dashboard():
-    conn = get_db_connection()
-    
-    # Get statistics
-    stats = {}
-    stats['total_students'] = conn.execute('SELECT COUNT(*) as count FROM students').fetchone()['count']
-    stats['total_colleges'] = conn.execute('SELECT COUNT(*) as count FROM colleges').fetchone()['count']
-    stats['total_departments'] = conn.execute('SELECT COUNT(*) as count FROM departments').fetchone()['count']
-    stats['total_exams'] = conn.execute('SELECT COUNT(*) as count FROM exam_sessions').fetchone()['count']
+    conn = get_db()
+    stats, success_rate = get_dashboard_stats(conn)
     
     # Recent recognition logs
     recent_logs = conn.execute('''
@@ -276,17 +748,6 @@ def dashboard():
         ORDER BY rl.created_at DESC LIMIT 10
     ''').fetchall()
     
-    # Recognition success rate
-    success_rate = conn.execute('''
-        SELECT 
-            COUNT(*) as total,
-            SUM(CASE WHEN success = 1 THEN 1 ELSE 0 END) as successful
-        FROM recognition_logs
-        WHERE created_at >= date('now', '-7 days')
-    ''').fetchone()
-    
-    conn.close()
-    
     return render_template('dashboard/main.html', 
                          stats=stats, 
                          recent_logs=recent_logs,
@@ -301,7 +762,7 @@ def students_list():
     page = int(request.args.get('page', 1))
     per_page = 20
     
-    conn = get_db_connection()
+    conn = get_db()
     
     # Build query
     query = '''
@@ -313,7 +774,12 @@ def students_list():
     '''
     params = []
     
-    if search:
+    if len(search) >= 3:
+        # Trigram FTS index answers substring matches without scanning students
+        query += ' AND s.id IN (SELECT rowid FROM students_fts WHERE students_fts MATCH ?)'
+        params.append('"' + search.replace('"', '""') + '"')
+    elif search:
+        # Trigrams need at least 3 characters, so short terms still use LIKE
         query += ' AND (s.first_name LIKE ? OR s.last_name LIKE ? OR s.student_id LIKE ?)'
         search_param = f'%{search}%'
         params.extend([search_param, search_param, search_param])
@@ -330,8 +796,6 @@ def students_list():
     # Get departments for filter
     departments = conn.execute('SELECT * FROM departments ORDER BY name').fetchall()
     
-    conn.close()
-    
     return render_template('students/list.html', 
                          students=students, 
                          departments=departments,
@@ -355,7 +819,7 @@ def add_student():
                     return redirect(request.url)
             
             # Check for duplicates
-            conn = get_db_connection()
+            conn = get_db()
             existing = conn.execute(
                 'SELECT id FROM students WHERE student_id = ? OR index_number = ?',
                 (data['student_id'], data['index_number'])
@@ -363,12 +827,11 @@ def add_student():
             
             if existing:
                 flash('Student ID or Index Number already exists', 'error')
-                conn.close()
                 return redirect(request.url)
             
             # Handle photo upload
             photo_path = None
-            face_encoding_json = None
+            face_encoding_blob = None
             
             if file and file.filename and allowed_file(file.filename):
                 filename = secure_filename(f"{data['student_id']}_{file.filename}")
@@ -377,13 +840,13 @@ def add_student():
                 
                 # Extract face encoding
                 encoding, error = save_face_encoding(photo_path, data['student_id'])
-                if encoding:
-                    face_encoding_json = json.dumps(encoding)
+                if encoding is not None:
+                    face_encoding_blob = encoding_to_blob(encoding)
                 else:
                     flash(f'Face encoding error: {error}', 'warning')
             
             # Insert student
-            conn.execute('''
+            cursor = conn.execute('''
                 INSERT INTO students 
                 (student_id, index_number, first_name, middle_name, last_name,
                  email, phone, date_of_birth, gender, address, emergency_contact,
@@ -398,11 +861,14 @@ def add_student():
                 data.get('emergency_phone'), data.get('college_id'),
                 data.get('department_id'), data.get('program'),
                 data.get('year_of_study'), data.get('admission_year'),
-                photo_path, face_encoding_json, session['admin_id']
+                photo_path, face_encoding_blob, session['admin_id']
             ))
             
             conn.commit()
-            conn.close()
+            
+            if face_encoding_blob is not None:
+                add_encoding(cursor.lastrowid, encoding)
+                invalidate_verification_cache()
             
             flash('Student added successfully!', 'success')
             return redirect(url_for('students_list'))
@@ -411,21 +877,17 @@ def add_student():
             flash(f'Error adding student: {str(e)}', 'error')
     
     # Get colleges and departments
-    conn = get_db_connection()
+    conn = get_db()
     colleges = conn.execute('SELECT * FROM colleges WHERE status = "active"').fetchall()
     departments = conn.execute('SELECT * FROM departments ORDER BY name').fetchall()
-    conn.close()
     
     return render_template('students/add.html', colleges=colleges, departments=departments)
 
 def save_face_encoding(image_path, student_id):
     """Extract and save face encoding from image"""
     try:
-        # Load image
-        image = face_recognition.load_image_file(image_path)
-        
-        # Get face encodings
-        face_encodings = face_recognition.face_encodings(image)
+        # Detect and encode in a worker process; dlib holds the GIL while it runs
+        face_encodings = get_face_pool().submit(encode_faces_in_file, image_path).result()
         
         if len(face_encodings) == 0:
             return None, "No face detected in the image"
@@ -438,7 +900,7 @@ def save_face_encoding(image_path, student_id):
         encoding_file = os.path.join(ENCODINGS_FOLDER, f"{student_id}.npy")
         np.save(encoding_file, encoding)
         
-        return encoding.tolist(), None
+        return encoding.astype(np.float32), None
         
     except Exception as e:
         return None, f"Error processing face: {str(e)}"
@@ -463,70 +925,58 @@ def api_verify_face():
         image_data = image_data.split(',')[1]
         image_bytes = base64.b64decode(image_data)
         
-        # Save temporary image
-        temp_path = f"temp_verify_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-        with open(temp_path, 'wb') as f:
-            f.write(image_bytes)
-        
-        try:
-            # Load and process image
-            unknown_image = face_recognition.load_image_file(temp_path)
-            unknown_encodings = face_recognition.face_encodings(unknown_image)
+        # Repeated frames are answered from the cache without re-running detection
+        cache_key, cached = get_cached_verification(image_bytes)
+        if cached is not None:
+            best_match = cached['student']
+        else:
+            unknown_encodings = get_probe_encodings(image_bytes)
             
             if len(unknown_encodings) == 0:
                 return jsonify({'success': False, 'message': 'No face detected in image'})
             
             unknown_encoding = unknown_encodings[0]
             
-            # Get all student encodings
-            conn = get_db_connection()
-            students = conn.execute(
-                'SELECT id, student_id, first_name, last_name, face_encoding FROM students WHERE face_encoding IS NOT NULL'
-            ).fetchall()
+            student_row_id, best_distance = find_best_match(unknown_encoding)
             
             best_match = None
-            best_distance = float('inf')
+            if student_row_id is not None and best_distance < RECOGNITION_THRESHOLD:
+                # Only the matched student's details are read from the database
+                conn = get_db()
+                student = conn.execute(
+                    'SELECT id, student_id, first_name, last_name FROM students WHERE id = ?',
+                    (student_row_id,)
+                ).fetchone()
+                
+                if student:
+                    best_match = {
+                        'id': student['id'],
+                        'student_id': student['student_id'],
+                        'name': f"{student['first_name']} {student['last_name']}",
+                        'confidence': 1 - best_distance
+                    }
             
-            for student in students:
-                if student['face_encoding']:
-                    stored_encoding = np.array(json.loads(student['face_encoding']))
-                    distance = face_recognition.face_distance([stored_encoding], unknown_encoding)[0]
-                    
-                    if distance < best_distance and distance < RECOGNITION_THRESHOLD:
-                        best_distance = distance
-                        best_match = {
-                            'id': student['id'],
-                            'student_id': student['student_id'],
-                            'name': f"{student['first_name']} {student['last_name']}",
-                            'confidence': 1 - distance
-                        }
+            cache_verification(cache_key, {'student': best_match})
+        
+        # Log recognition attempt
+        if best_match:
+            log_recognition_attempt(
+                best_match['id'], True, best_match['confidence'], 'camera',
+                f'Successful verification with confidence: {best_match["confidence"]:.2f}'
+            )
+            
+            return jsonify({
+                'success': True,
+                'student': best_match,
+                'message': f"Match found: {best_match['name']}"
+            })
+        else:
+            log_recognition_attempt(
+                None, False, 0, 'camera', 'No matching student found'
+            )
+            
+            return jsonify({'success': False, 'message': 'No matching student found'})
             
-            # Log recognition attempt
-            if best_match:
-                log_recognition_attempt(
-                    best_match['id'], True, best_match['confidence'], 'camera',
-                    f'Successful verification with confidence: {best_match["confidence"]:.2f}'
-                )
-                
-                conn.close()
-                return jsonify({
-                    'success': True,
-                    'student': best_match,
-                    'message': f"Match found: {best_match['name']}"
-                })
-            else:
-                log_recognition_attempt(
-                    None, False, 0, 'camera', 'No matching student found'
-                )
-                
-                conn.close()
-                return jsonify({'success': False, 'message': 'No matching student found'})
-                
-        finally:
-            # Clean up temporary file
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-                
     except Exception as e:
         logging.error(f"Face verification error: {str(e)}")
         return jsonify({'success': False, 'message': f'Error: {str(e)}'})
@@ -535,12 +985,11 @@ def api_verify_face():
 @app.route('/api/departments/<int:college_id>')
 @login_required
 def get_departments(college_id):
-    conn = get_db_connection()
+    conn = get_db()
     departments = conn.execute(
         'SELECT * FROM departments WHERE college_id = ? ORDER BY name',
         (college_id,)
     ).fetchall()
-    conn.close()
     
     return jsonify([{
         'id': d['id'],
@@ -550,4 +999,6 @@ def get_departments(college_id):
 
 if __name__ == '__main__':
     init_enhanced_db()
+    migrate_database()
+    reload_encodings()
     app.run(debug=True, host='0.0.0.0', port=5001)
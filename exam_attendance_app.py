@@ -1,14 +1,19 @@
 # Student Exam Attendance System with Face Verification
 # exam_attendance_app.py
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, flash, session, g, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 import cv2
 import numpy as np
 import os
 import base64
+import csv
+import io
+import itertools
 import sqlite3
 from datetime import datetime, timedelta
 import face_recognition
+import dlib
 from werkzeug.utils import secure_filename
 import json
 import hashlib
@@ -17,9 +22,33 @@ import random
 import string
 from functools import wraps
 import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
-from database import get_db_connection, init_enhanced_db, hash_password, verify_password
-from email_service import EmailService
+from database import acquire_connection, release_connection, init_enhanced_db, migrate_database, hash_password, verify_password, encoding_to_blob, decode_encoding
+from email_service import get_default_service
+
+try:
+    import faiss
+except ImportError:  # Optional: matching falls back to a NumPy scan
+    faiss = None
+
+try:
+    import numba
+except ImportError:  # Optional: matching skips the int8 pre-filter
+    numba = None
+
+try:
+    import orjson
+except ImportError:  # Optional: responses use Flask's default JSON encoder
+    orjson = None
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    _jpeg = TurboJPEG()
+except (ImportError, RuntimeError):  # Optional: JPEG decoding falls back to OpenCV
+    _jpeg = None
 
 # Load environment variables from .env file
 load_dotenv()
@@ -27,11 +56,61 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = secrets.token_hex(32)
 
+if orjson is not None:
+    class OrjsonProvider(DefaultJSONProvider):
+        """Serialize jsonify() responses with orjson"""
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+        
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+        
+        def response(self, *args, **kwargs):
+            obj = self._prepare_response_obj(args, kwargs)
+            body = orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS)
+            return self._app.response_class(body, mimetype=self.mimetype)
+    
+    app.json = OrjsonProvider(app)
+
 # Configuration
 UPLOAD_FOLDER = 'static/student_photos'
 ENCODINGS_FOLDER = 'face_encodings'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+# Snapshot of the verification gallery, memory-mapped on restart while still current
+GALLERY_FILE = os.path.join(ENCODINGS_FOLDER, 'gallery.npy')
+GALLERY_IDS_FILE = os.path.join(ENCODINGS_FOLDER, 'gallery_ids.npy')
+GALLERY_STATE_FILE = os.path.join(ENCODINGS_FOLDER, 'gallery.json')
+GALLERY_INDEX_FILE = os.path.join(ENCODINGS_FOLDER, 'gallery.faiss')
 RECOGNITION_THRESHOLD = 0.6
+STRONG_MATCH_THRESHOLD = 0.35  # Distance below which the scan stops early
+MATCH_BLOCK_ROWS = 4096  # Encodings scored per GEMV before checking for a strong match
+INT8_CANDIDATES = 20  # Rows re-scored in float32 after the int8 pre-filter
+FAISS_HNSW_MIN_SIZE = 10000  # Smaller galleries are scanned exactly
+FAISS_HNSW_M = 32
+FAISS_HNSW_EF_SEARCH = 64
+# Face detector: 'cnn' needs a CUDA build of dlib to be practical, 'hog' runs on the CPU
+FACE_MODEL = os.getenv('FACE_MODEL', 'cnn' if dlib.DLIB_USE_CUDA else 'hog')
+# Worker processes for face encoding, so dlib doesn't hold request threads
+FACE_WORKERS = int(os.getenv('FACE_WORKERS', os.cpu_count() or 1))
+FACE_ENCODE_TIMEOUT = 10  # Seconds
+VERIFY_BATCH_SIZE = 32  # Most images accepted by /student/verify_batch
+ADMIN_PAGE_SIZE = 50  # Rows per page on the admin student and attendance lists
+
+# Encodings of active students: row i of 'known' belongs to students.id ids[i]
+# and 'known_i8' holds the same rows quantized with one shared 'scale'.
+# 'index' is a FAISS HNSW graph over 'known' for large galleries, else None.
+# Writers bump 'version'; readers rebuild when 'loaded' falls behind it.
+_encoding_cache = {
+    'ids': [],
+    'known': None,
+    'sq_norms': None,
+    'known_i8': None,
+    'scale': 1.0,
+    'index': None,
+    'version': 0,
+    'loaded': -1,
+    'lock': threading.Lock(),
+}
 
 # Email Configuration
 EMAIL_PROVIDER = os.getenv('EMAIL_PROVIDER', 'gmail')
@@ -39,7 +118,7 @@ EMAIL_SERVICE = None
 
 # Initialize email service
 try:
-    EMAIL_SERVICE = EmailService(provider=EMAIL_PROVIDER)
+    EMAIL_SERVICE = get_default_service(EMAIL_PROVIDER)
     logging.info(f"Email service initialized with provider: {EMAIL_PROVIDER}")
 except Exception as e:
     logging.warning(f"Email service initialization failed: {str(e)}")
@@ -58,6 +137,27 @@ logging.basicConfig(
     format='%(asctime)s %(levelname)s %(name)s %(message)s'
 )
 
+def get_db():
+    """Return the connection for the current request, taking one from the pool on first use"""
+    db = getattr(g, '_db', None)
+    if db is None:
+        db = g._db = acquire_connection()
+    return db
+
+@app.teardown_appcontext
+def close_db(exception):
+    db = g.pop('_db', None)
+    if db is not None:
+        release_connection(db)
+
+def fetch_dicts(conn, query, params=()):
+    """Run a query and return its rows as plain dicts, reading the column names once"""
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(query, params)
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor]
+
 def login_required(f):
     """Decorator to require login"""
     @wraps(f)
@@ -75,22 +175,79 @@ def generate_student_id():
     timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
     return f"STU{timestamp}{random.randint(100, 999)}"
 
+def decode_data_url(data):
+    """Decode a base64 image, with or without a data: URI prefix"""
+    if data.startswith('data:'):
+        # The header is normally short, so look for its comma near the start first
+        comma = data.find(',', 0, 100)
+        if comma < 0:
+            comma = data.find(',')
+        if comma < 0:
+            raise ValueError('Malformed image data URL: missing comma after the header')
+        data = data[comma + 1:]
+    return base64.b64decode(data)
+
+def decode_rgb(image_bytes):
+    """Decode image bytes to an RGB array, letting libjpeg-turbo emit RGB directly for JPEGs"""
+    if _jpeg is not None and image_bytes[:3] == b'\xff\xd8\xff':
+        return _jpeg.decode(image_bytes, pixel_format=TJPF_RGB)
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+_face_pool = None
+_face_pool_lock = threading.Lock()
+
+def get_face_pool():
+    """Return the shared process pool used for face encoding"""
+    global _face_pool
+    if _face_pool is None:
+        with _face_pool_lock:
+            if _face_pool is None:
+                # Forking once the app's background threads are running can hand a child a
+                # lock that is held forever, so workers start from a clean process
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                _face_pool = ProcessPoolExecutor(max_workers=FACE_WORKERS,
+                                                 mp_context=multiprocessing.get_context(method))
+    return _face_pool
+
+def encode_faces_in_bytes(image_bytes):
+    """Return the face encodings found in encoded image bytes (runs in a worker process)"""
+    return face_recognition.face_encodings(decode_rgb(image_bytes))
+
+def encode_faces_in_batch(images_bytes):
+    """Return the first face encoding (or None) for each image (runs in a worker process)"""
+    images = []
+    for image_bytes in images_bytes:
+        try:
+            images.append(decode_rgb(image_bytes))
+        except (OSError, cv2.error):
+            # An undecodable image is reported like one without a face
+            images.append(None)
+    decoded = [image for image in images if image is not None]
+    
+    if FACE_MODEL == 'cnn' and dlib.DLIB_USE_CUDA and len({image.shape for image in decoded}) == 1:
+        # The CNN detector runs same-sized images through the GPU in one call
+        batch_locations = face_recognition.batch_face_locations(decoded, batch_size=VERIFY_BATCH_SIZE)
+    else:
+        batch_locations = [face_recognition.face_locations(image, model=FACE_MODEL) for image in decoded]
+    
+    encodings = []
+    locations = iter(batch_locations)
+    for image in images:
+        found = image is not None and face_recognition.face_encodings(image, known_face_locations=next(locations))
+        encodings.append(found[0] if found else None)
+    return encodings
+
 def save_face_encoding(image_data, student_id):
     """Save face encoding from base64 image data"""
     try:
         # Decode base64 image
-        image_data = image_data.split(',')[1] if ',' in image_data else image_data
-        image_bytes = base64.b64decode(image_data)
+        image_bytes = decode_data_url(image_data)
         
-        # Convert to numpy array
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        # Convert BGR to RGB
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        
-        # Get face encodings
-        face_encodings = face_recognition.face_encodings(rgb_image)
+        # Get face encodings in a worker while the photo is decoded here for saving
+        future = get_face_pool().submit(encode_faces_in_bytes, image_bytes)
+        image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+        face_encodings = future.result(timeout=FACE_ENCODE_TIMEOUT)
         
         if face_encodings:
             # Save image file
@@ -106,7 +263,7 @@ def save_face_encoding(image_data, student_id):
             return {
                 'success': True,
                 'image_path': image_path,
-                'encoding': face_encodings[0].tolist(),
+                'encoding': face_encodings[0],
                 'message': 'Face data saved successfully'
             }
         else:
@@ -120,9 +277,200 @@ def save_face_encoding(image_data, student_id):
             'message': f'Error processing face data: {str(e)}'
         }
 
+def invalidate_encoding_cache():
+    """Mark the cached encodings stale after a student insert/update/delete"""
+    with _encoding_cache['lock']:
+        _encoding_cache['version'] += 1
+
+def gallery_fingerprint(conn):
+    """Summary of the active students that changes whenever the gallery would"""
+    row = conn.execute('''
+        SELECT COUNT(*), MAX(id), MAX(updated_at) FROM students
+        WHERE status = "active" AND face_encoding IS NOT NULL
+    ''').fetchone()
+    return list(row)
+
+def load_gallery_snapshot(fingerprint):
+    """Return (ids, known, index) from the snapshot files if they match fingerprint, else None"""
+    try:
+        with open(GALLERY_STATE_FILE) as f:
+            if json.load(f)['fingerprint'] != fingerprint:
+                return None
+        ids = np.load(GALLERY_IDS_FILE).tolist()
+        known = np.load(GALLERY_FILE, mmap_mode='r')
+    except (OSError, ValueError, KeyError):
+        return None
+    if len(ids) != len(known):
+        return None
+    
+    index = None
+    if faiss is not None and os.path.exists(GALLERY_INDEX_FILE):
+        try:
+            index = faiss.read_index(GALLERY_INDEX_FILE)
+        except RuntimeError:
+            pass
+        if index is not None and index.ntotal != len(ids):
+            index = None
+    return ids, known, index
+
+def save_gallery_snapshot(fingerprint, ids, known, index):
+    """Write the gallery snapshot; the state file goes last so readers never see a partial one"""
+    suffix = f'.{os.getpid()}.tmp'
+    try:
+        if os.path.exists(GALLERY_STATE_FILE):
+            os.remove(GALLERY_STATE_FILE)
+        for path, array in ((GALLERY_FILE, known), (GALLERY_IDS_FILE, np.asarray(ids, dtype=np.int64))):
+            with open(path + suffix, 'wb') as f:
+                np.save(f, array)
+            os.replace(path + suffix, path)
+        if index is not None:
+            faiss.write_index(index, GALLERY_INDEX_FILE + suffix)
+            os.replace(GALLERY_INDEX_FILE + suffix, GALLERY_INDEX_FILE)
+        elif os.path.exists(GALLERY_INDEX_FILE):
+            os.remove(GALLERY_INDEX_FILE)
+        with open(GALLERY_STATE_FILE + suffix, 'w') as f:
+            json.dump({'fingerprint': fingerprint}, f)
+        os.replace(GALLERY_STATE_FILE + suffix, GALLERY_STATE_FILE)
+    except (OSError, RuntimeError) as e:
+        logging.warning(f"Could not save gallery snapshot: {str(e)}")
+
+def build_faiss_index(known):
+    """Build a FAISS HNSW index over (N, 128) float32 encodings"""
+    index = faiss.IndexHNSWFlat(128, FAISS_HNSW_M)
+    index.add(np.ascontiguousarray(known, dtype=np.float32))
+    return index
+
+def get_known_encodings():
+    """Return (ids, known, sq_norms, known_i8, scale, index) for all active students, reloading only when stale"""
+    with _encoding_cache['lock']:
+        version = _encoding_cache['version']
+        if _encoding_cache['loaded'] == version:
+            return (_encoding_cache['ids'], _encoding_cache['known'], _encoding_cache['sq_norms'],
+                    _encoding_cache['known_i8'], _encoding_cache['scale'], _encoding_cache['index'])
+    
+    conn = get_db()
+    fingerprint = gallery_fingerprint(conn)
+    snapshot = load_gallery_snapshot(fingerprint)
+    if snapshot is not None:
+        ids, known, index = snapshot
+    else:
+        # Recently verified students first, so their strong matches end the scan early
+        rows = conn.execute('''
+            SELECT s.id, s.face_encoding
+            FROM students s
+            LEFT JOIN (
+                SELECT student_id, MAX(created_at) as last_verified
+                FROM recognition_logs
+                WHERE success = 1
+                GROUP BY student_id
+            ) rl ON rl.student_id = s.id
+            WHERE s.status = "active" AND s.face_encoding IS NOT NULL
+            ORDER BY rl.last_verified DESC
+        ''').fetchall()
+        
+        ids = []
+        known = []
+        for row in rows:
+            encoding = decode_encoding(row['face_encoding'])
+            if encoding.shape == (128,):
+                ids.append(row['id'])
+                known.append(encoding)
+        known = np.ascontiguousarray(known, dtype=np.float32).reshape(-1, 128)
+        index = None
+    
+    if index is None and faiss is not None and len(ids) >= FAISS_HNSW_MIN_SIZE:
+        index = build_faiss_index(known)
+    if snapshot is None:
+        save_gallery_snapshot(fingerprint, ids, known, index)
+    if index is not None:
+        index.hnsw.efSearch = FAISS_HNSW_EF_SEARCH
+    
+    sq_norms = np.einsum('ij,ij->i', known, known)
+    scale = float(np.abs(known).max(initial=0)) / 127 or 1.0
+    known_i8 = np.rint(known / scale).astype(np.int8)
+    
+    with _encoding_cache['lock']:
+        # Don't overwrite a newer invalidation that raced with this load
+        if _encoding_cache['version'] == version:
+            _encoding_cache.update(ids=ids, known=known, sq_norms=sq_norms, known_i8=known_i8,
+                                   scale=scale, index=index, loaded=version)
+    return ids, known, sq_norms, known_i8, scale, index
+
+if numba is not None:
+    @numba.njit(parallel=True, cache=True)
+    def _int8_sq_distances(known_i8, q_i8):
+        """Approximate squared distances, in quantized units, with int32 accumulation"""
+        out = np.empty(known_i8.shape[0], dtype=np.int32)
+        for i in numba.prange(known_i8.shape[0]):
+            s = np.int32(0)
+            # LLVM vectorizes this to sign-extend/subtract/pmaddwd on AVX2 and AVX-512
+            for k in range(known_i8.shape[1]):
+                d = np.int32(known_i8[i, k]) - np.int32(q_i8[k])
+                s += d * d
+            out[i] = s
+        return out
+
+def find_best_match(encoding):
+    """Return (students.id, distance) of the closest active student within RECOGNITION_THRESHOLD, or (None, None)"""
+    ids, known, sq_norms, known_i8, scale, index = get_known_encodings()
+    q = np.asarray(encoding, dtype=np.float32)
+    qq = np.dot(q, q)
+    best_index, best_sq = -1, RECOGNITION_THRESHOLD ** 2
+    
+    if index is not None:
+        # Approximate nearest neighbour by HNSW graph descent instead of a full scan
+        sq_distances, rows = index.search(q.reshape(1, 128), 1)
+        if rows[0, 0] >= 0 and sq_distances[0, 0] < best_sq:
+            best_index, best_sq = int(rows[0, 0]), sq_distances[0, 0]
+    elif numba is not None and len(ids) > MATCH_BLOCK_ROWS:
+        # Shortlist with int8 distances (a quarter of the memory traffic),
+        # then score only the shortlist exactly in float32
+        q_i8 = np.clip(np.rint(q / scale), -127, 127).astype(np.int8)
+        approx = _int8_sq_distances(known_i8, q_i8)
+        candidates = np.argpartition(approx, INT8_CANDIDATES)[:INT8_CANDIDATES]
+        partial = sq_norms[candidates] - 2 * (known[candidates] @ q)
+        i = int(partial.argmin())
+        if partial[i] + qq < best_sq:
+            best_index, best_sq = int(candidates[i]), partial[i] + qq
+    else:
+        for start in range(0, len(ids), MATCH_BLOCK_ROWS):
+            block = slice(start, start + MATCH_BLOCK_ROWS)
+            # ||k - q||^2 = ||k||^2 + ||q||^2 - 2 k.q, so each block is one GEMV.
+            # ||q||^2 is the same for every row; it is only added back for the winner.
+            partial = sq_norms[block] - 2 * (known[block] @ q)
+            i = int(partial.argmin())
+            if partial[i] + qq < best_sq:
+                best_index, best_sq = start + i, partial[i] + qq
+                if best_sq < STRONG_MATCH_THRESHOLD ** 2:
+                    break
+    if best_index < 0:
+        return None, None
+    return ids[best_index], float(np.sqrt(max(best_sq, 0)))
+
+def find_best_matches(encodings):
+    """Return a (students.id, distance) or (None, None) pair for each of several encodings"""
+    ids, known, sq_norms, _, _, index = get_known_encodings()
+    probes = np.asarray(encodings, dtype=np.float32).reshape(-1, 128)
+    if not len(ids):
+        return [(None, None)] * len(probes)
+    
+    if index is not None:
+        sq_distances, rows = index.search(probes, 1)
+        rows, best_sq = rows[:, 0], sq_distances[:, 0]
+    else:
+        # One GEMM scores every probe against every stored encoding; each
+        # probe's own norm doesn't change its ranking, so add it to winners only
+        partial = sq_norms[:, None] - 2 * (known @ probes.T)
+        rows = partial.argmin(axis=0)
+        best_sq = partial[rows, np.arange(len(probes))] + np.einsum('ij,ij->i', probes, probes)
+    return [
+        (ids[i], float(np.sqrt(max(d, 0)))) if i >= 0 and d < RECOGNITION_THRESHOLD ** 2 else (None, None)
+        for i, d in zip(rows, best_sq)
+    ]
+
 def find_exam_room_for_student(index_number, exam_session_id=None):
     """Find exam room assignment for student based on index number"""
-    conn = get_db_connection()
+    conn = get_db()
     
     # If specific exam session provided, use it; otherwise use current active session
     if exam_session_id:
@@ -146,10 +494,87 @@ def find_exam_room_for_student(index_number, exam_session_id=None):
     '''
     
     result = conn.execute(query, params).fetchone()
-    conn.close()
     
     return dict(result) if result else None
 
+def record_verification(conn, student_id, distance):
+    """Log a verification attempt and mark attendance; return (student_info, attendance_marked)"""
+    best_match = None
+    if student_id is not None:
+        best_match = conn.execute('''
+            SELECT s.id, s.student_id, s.index_number, s.first_name, s.middle_name,
+                   s.last_name, s.email, s.year_of_study,
+                   c.name as college_name, d.name as department_name,
+                   ay.year_code as academic_year
+            FROM students s
+            JOIN colleges c ON s.college_id = c.id
+            JOIN departments d ON s.department_id = d.id
+            JOIN academic_years ay ON s.academic_year_id = ay.id
+            WHERE s.id = ?
+        ''', (student_id,)).fetchone()
+    
+    if not best_match:
+        # Log failed verification
+        with conn:
+            conn.execute('''
+                INSERT INTO recognition_logs (
+                    recognition_type, success, confidence_score,
+                    method, ip_address, user_agent
+                ) VALUES (?, ?, ?, ?, ?, ?)
+            ''', (
+                'exam_verification', False, 0.0,
+                'face_recognition', request.remote_addr, request.headers.get('User-Agent')
+            ))
+        return None, False
+    
+    # Get exam room assignment
+    room_assignment = find_exam_room_for_student(best_match['index_number'])
+    
+    # Log the verification and record attendance in one transaction
+    with conn:
+        conn.execute('''
+            INSERT INTO recognition_logs (
+                student_id, recognition_type, success, confidence_score,
+                method, ip_address, user_agent
+            ) VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            best_match['id'], 'exam_verification', True, 1.0 - distance,
+            'face_recognition', request.remote_addr, request.headers.get('User-Agent')
+        ))
+        
+        # Record attendance if exam room found; app-written times are local,
+        # like the datetime.now() values enhanced_app stores
+        if room_assignment:
+            conn.execute('''
+                INSERT OR REPLACE INTO exam_attendance (
+                    student_id, exam_session_id, verification_time, room_assignment,
+                    verification_method, confidence_score, status
+                ) VALUES (?, ?, datetime('now', 'localtime'), ?, ?, ?, ?)
+            ''', (
+                best_match['id'], room_assignment['exam_session_id'],
+                f"{room_assignment['room_number']} - {room_assignment['building']}",
+                'face_recognition', 1.0 - distance, 'present'
+            ))
+    
+    ra = room_assignment or {}
+    student_info = {
+        'name': f"{best_match['first_name']} {best_match['middle_name']} {best_match['last_name']}".strip(),
+        'index_number': best_match['index_number'],
+        'student_id': best_match['student_id'],
+        'email': best_match['email'],
+        'college': best_match['college_name'],
+        'department': best_match['department_name'],
+        'year_of_study': best_match['year_of_study'],
+        'academic_year': best_match['academic_year'],
+        'confidence': round((1.0 - distance) * 100, 2),
+        'exam_room': ra.get('room_number', 'Not Assigned'),
+        'building': ra.get('building', ''),
+        'exam_title': ra.get('exam_title', ''),
+        'exam_date': ra.get('exam_date', ''),
+        'exam_time': f"{ra.get('start_time', '')} - {ra.get('end_time', '')}" if ra else ''
+    }
+    return student_info, bool(room_assignment)
+
 # ===============================
 # PUBLIC ENDPOINTS
 # ===============================
@@ -162,14 +587,13 @@ def index():
 @app.route('/student/register')
 def student_register():
     """Public student registration page"""
-    conn = get_db_connection()
+    conn = get_db()
     colleges = conn.execute(
         'SELECT * FROM colleges WHERE status = "active" ORDER BY name'
     ).fetchall()
     academic_years = conn.execute(
         'SELECT * FROM academic_years WHERE status = "active" ORDER BY start_year DESC'
     ).fetchall()
-    conn.close()
     
     return render_template('public/student_register.html', 
                          colleges=colleges, 
@@ -178,14 +602,14 @@ def student_register():
 @app.route('/api/departments/<int:college_id>')
 def get_departments_by_college(college_id):
     """API endpoint to get departments by college ID"""
-    conn = get_db_connection()
-    departments = conn.execute(
+    conn = get_db()
+    departments = fetch_dicts(
+        conn,
         'SELECT * FROM departments WHERE college_id = ? AND status = "active" ORDER BY name',
         (college_id,)
-    ).fetchall()
-    conn.close()
+    )
     
-    return jsonify([dict(dept) for dept in departments])
+    return jsonify(departments)
 
 @app.route('/student/register', methods=['POST'])
 def student_register_submit():
@@ -205,20 +629,18 @@ def student_register_submit():
                 return jsonify({'success': False, 'message': f'{field} is required'})
         
         # Check if index number or email already exists
-        conn = get_db_connection()
+        conn = get_db()
         existing = conn.execute(
             'SELECT id FROM students WHERE index_number = ? OR email = ?',
             (data['index_number'], data['email'])
         ).fetchone()
         
         if existing:
-            conn.close()
             return jsonify({'success': False, 'message': 'Student with this index number or email already exists'})
         
         # Process face image
         face_result = save_face_encoding(data['face_image'], student_id)
         if not face_result['success']:
-            conn.close()
             return jsonify({'success': False, 'message': face_result['message']})
         
         # Insert student record
@@ -237,11 +659,11 @@ def student_register_submit():
             data.get('emergency_contact', ''), data.get('emergency_phone', ''),
             data['college_id'], data['department_id'], data.get('program', ''),
             data['year_of_study'], data['academic_year_id'],
-            face_result['image_path'], json.dumps(face_result['encoding']), 'active'
+            face_result['image_path'], encoding_to_blob(face_result['encoding']), 'active'
         ))
         
         conn.commit()
-        conn.close()
+        invalidate_encoding_cache()
         
         return jsonify({
             'success': True,
@@ -268,114 +690,30 @@ def student_verify_submit():
             return jsonify({'success': False, 'message': 'Face image is required'})
         
         # Decode and process face image
-        image_data = face_image.split(',')[1] if ',' in face_image else face_image
-        image_bytes = base64.b64decode(image_data)
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        image_bytes = decode_data_url(face_image)
         
-        # Get face encodings from submitted image
-        face_encodings = face_recognition.face_encodings(rgb_image)
+        # Encode in a worker; refresh the encoding cache meanwhile if it is stale
+        future = get_face_pool().submit(encode_faces_in_bytes, image_bytes)
+        get_known_encodings()
+        face_encodings = future.result(timeout=FACE_ENCODE_TIMEOUT)
         
         if not face_encodings:
             return jsonify({'success': False, 'message': 'No face detected in the image'})
         
         submitted_encoding = face_encodings[0]
         
-        # Compare with all stored student encodings
-        conn = get_db_connection()
-        students = conn.execute('''
-            SELECT s.*, c.name as college_name, d.name as department_name,
-                   ay.year_code as academic_year
-            FROM students s
-            JOIN colleges c ON s.college_id = c.id
-            JOIN departments d ON s.department_id = d.id
-            JOIN academic_years ay ON s.academic_year_id = ay.id
-            WHERE s.status = "active" AND s.face_encoding IS NOT NULL
-        ''').fetchall()
-        
-        best_match = None
-        best_distance = float('inf')
+        # Compare with all cached student encodings
+        best_match_id, best_distance = find_best_match(submitted_encoding)
+        student_info, attendance_marked = record_verification(get_db(), best_match_id, best_distance)
         
-        for student in students:
-            try:
-                stored_encoding = np.array(json.loads(student['face_encoding']))
-                distance = face_recognition.face_distance([stored_encoding], submitted_encoding)[0]
-                
-                if distance < RECOGNITION_THRESHOLD and distance < best_distance:
-                    best_distance = distance
-                    best_match = student
-            except:
-                continue
-        
-        if best_match:
-            # Get exam room assignment
-            room_assignment = find_exam_room_for_student(best_match['index_number'])
-            
-            # Log the verification
-            conn.execute('''
-                INSERT INTO recognition_logs (
-                    student_id, recognition_type, success, confidence_score,
-                    method, ip_address, user_agent
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                best_match['id'], 'exam_verification', True, 1.0 - best_distance,
-                'face_recognition', request.remote_addr, request.headers.get('User-Agent')
-            ))
-            
-            # Record attendance if exam room found
-            if room_assignment:
-                conn.execute('''
-                    INSERT OR REPLACE INTO exam_attendance (
-                        student_id, exam_session_id, verification_time, room_assignment,
-                        verification_method, confidence_score, status
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    best_match['id'], room_assignment['exam_session_id'], datetime.now(),
-                    f"{room_assignment['room_number']} - {room_assignment['building']}",
-                    'face_recognition', 1.0 - best_distance, 'present'
-                ))
-            
-            conn.commit()
-            conn.close()
-            
-            student_info = {
-                'name': f"{best_match['first_name']} {best_match['middle_name']} {best_match['last_name']}".strip(),
-                'index_number': best_match['index_number'],
-                'student_id': best_match['student_id'],
-                'email': best_match['email'],
-                'college': best_match['college_name'],
-                'department': best_match['department_name'],
-                'year_of_study': best_match['year_of_study'],
-                'academic_year': best_match['academic_year'],
-                'confidence': round((1.0 - best_distance) * 100, 2),
-                'exam_room': room_assignment['room_number'] if room_assignment else 'Not Assigned',
-                'building': room_assignment['building'] if room_assignment else '',
-                'exam_title': room_assignment.get('exam_title', '') if room_assignment else '',
-                'exam_date': room_assignment.get('exam_date', '') if room_assignment else '',
-                'exam_time': f"{room_assignment.get('start_time', '')} - {room_assignment.get('end_time', '')}" if room_assignment else ''
-            }
-            
+        if student_info:
             return jsonify({
                 'success': True,
                 'message': 'Student verified successfully!',
                 'student': student_info,
-                'attendance_marked': bool(room_assignment)
+                'attendance_marked': attendance_marked
             })
         else:
-            # Log failed verification
-            conn.execute('''
-                INSERT INTO recognition_logs (
-                    recognition_type, success, confidence_score,
-                    method, ip_address, user_agent
-                ) VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                'exam_verification', False, 0.0,
-                'face_recognition', request.remote_addr, request.headers.get('User-Agent')
-            ))
-            conn.commit()
-            conn.close()
-            
             return jsonify({
                 'success': False,
                 'message': 'Student not recognized. Please ensure good lighting and face the camera directly.'
@@ -384,6 +722,50 @@ def student_verify_submit():
     except Exception as e:
         return jsonify({'success': False, 'message': f'Verification failed: {str(e)}'})
 
+@app.route('/student/verify_batch', methods=['POST'])
+def student_verify_batch_submit():
+    """Handle verification of several face images in one request"""
+    try:
+        data = request.json
+        face_images = data.get('images')
+        
+        if not face_images:
+            return jsonify({'success': False, 'message': 'At least one face image is required'})
+        if len(face_images) > VERIFY_BATCH_SIZE:
+            return jsonify({'success': False, 'message': f'At most {VERIFY_BATCH_SIZE} images per request'})
+        
+        images_bytes = [decode_data_url(face_image) for face_image in face_images]
+        
+        # Encode in a worker; refresh the encoding cache meanwhile if it is stale
+        future = get_face_pool().submit(encode_faces_in_batch, images_bytes)
+        get_known_encodings()
+        encodings = future.result(timeout=FACE_ENCODE_TIMEOUT * len(images_bytes))
+        
+        found = [encoding for encoding in encodings if encoding is not None]
+        matches = iter(find_best_matches(found))
+        conn = get_db()
+        
+        results = []
+        for encoding in encodings:
+            if encoding is None:
+                results.append({'success': False, 'message': 'No face detected in the image'})
+                continue
+            student_id, distance = next(matches)
+            student_info, attendance_marked = record_verification(conn, student_id, distance)
+            if student_info:
+                results.append({
+                    'success': True,
+                    'student': student_info,
+                    'attendance_marked': attendance_marked
+                })
+            else:
+                results.append({'success': False, 'message': 'Student not recognized'})
+        
+        return jsonify({'success': True, 'results': results})
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Verification failed: {str(e)}'})
+
 # ===============================
 # ADMIN PANEL ROUTES
 # ===============================
@@ -404,7 +786,7 @@ def admin_login_submit():
     username = request.form['username']
     password = request.form['password']
     
-    conn = get_db_connection()
+    conn = get_db()
     admin = conn.execute(
         'SELECT * FROM admins WHERE username = ? AND is_active = 1',
         (username,)
@@ -418,16 +800,14 @@ def admin_login_submit():
         
         # Update last login
         conn.execute(
-            'UPDATE admins SET last_login = ? WHERE id = ?',
-            (datetime.now(), admin['id'])
+            "UPDATE admins SET last_login = datetime('now', 'localtime') WHERE id = ?",
+            (admin['id'],)
         )
         conn.commit()
-        conn.close()
         
         flash('Login successful!', 'success')
         return redirect(url_for('admin_dashboard'))
     else:
-        conn.close()
         flash('Invalid username or password', 'error')
         return redirect(url_for('admin_login'))
 
@@ -442,14 +822,23 @@ def admin_logout():
 @login_required
 def admin_dashboard():
     """Admin dashboard"""
-    conn = get_db_connection()
+    conn = get_db()
     
-    # Get statistics
+    # Get statistics in a single round-trip
+    row = conn.execute('''
+        SELECT
+            (SELECT COUNT(*) FROM students WHERE status = "active"),
+            (SELECT COUNT(*) FROM colleges WHERE status = "active"),
+            (SELECT COUNT(*) FROM departments WHERE status = "active"),
+            -- created_at is a UTC default; count from local midnight
+            (SELECT COUNT(*) FROM recognition_logs
+             WHERE created_at >= datetime(date('now', 'localtime'), 'utc'))
+    ''').fetchone()
     stats = {
-        'total_students': conn.execute('SELECT COUNT(*) as count FROM students WHERE status = "active"').fetchone()['count'],
-        'total_colleges': conn.execute('SELECT COUNT(*) as count FROM colleges WHERE status = "active"').fetchone()['count'],
-        'total_departments': conn.execute('SELECT COUNT(*) as count FROM departments WHERE status = "active"').fetchone()['count'],
-        'today_verifications': conn.execute('SELECT COUNT(*) as count FROM recognition_logs WHERE date(created_at) = date("now")').fetchone()['count'],
+        'total_students': row[0],
+        'total_colleges': row[1],
+        'total_departments': row[2],
+        'today_verifications': row[3],
     }
     
     # Recent verifications
@@ -461,8 +850,6 @@ def admin_dashboard():
         LIMIT 10
     ''').fetchall()
     
-    conn.close()
-    
     return render_template('admin/dashboard.html', 
                          stats=stats, 
                          recent_verifications=recent_verifications)
@@ -471,9 +858,8 @@ def admin_dashboard():
 @login_required
 def admin_colleges():
     """Colleges management page"""
-    conn = get_db_connection()
+    conn = get_db()
     colleges = conn.execute('SELECT * FROM colleges ORDER BY name').fetchall()
-    conn.close()
     
     return render_template('admin/colleges.html', colleges=colleges)
 
@@ -483,7 +869,7 @@ def admin_colleges_create():
     """Create new college"""
     data = request.form
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         conn.execute('''
             INSERT INTO colleges (name, code, address, phone, email, established_year)
@@ -497,8 +883,6 @@ def admin_colleges_create():
         flash('College created successfully!', 'success')
     except sqlite3.IntegrityError:
         flash('College name or code already exists!', 'error')
-    finally:
-        conn.close()
     
     return redirect(url_for('admin_colleges'))
 
@@ -506,7 +890,7 @@ def admin_colleges_create():
 @login_required
 def admin_departments():
     """Departments management page"""
-    conn = get_db_connection()
+    conn = get_db()
     departments = conn.execute('''
         SELECT d.*, c.name as college_name
         FROM departments d
@@ -514,7 +898,6 @@ def admin_departments():
         ORDER BY c.name, d.name
     ''').fetchall()
     colleges = conn.execute('SELECT * FROM colleges WHERE status = "active" ORDER BY name').fetchall()
-    conn.close()
     
     return render_template('admin/departments.html', 
                          departments=departments, 
@@ -526,7 +909,7 @@ def admin_departments_create():
     """Create new department"""
     data = request.form
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         conn.execute('''
             INSERT INTO departments (college_id, name, code, head_name, email, phone)
@@ -540,34 +923,101 @@ def admin_departments_create():
         flash('Department created successfully!', 'success')
     except sqlite3.IntegrityError:
         flash('Department code already exists in this college!', 'error')
-    finally:
-        conn.close()
     
     return redirect(url_for('admin_departments'))
 
+def student_filters(args):
+    """WHERE clause, params and active filters for the admin students list"""
+    filters = {key: args.get(key, '').strip() for key in ('q', 'college', 'status')}
+    filters = {key: value for key, value in filters.items() if value}
+    clauses, params = [], []
+    if 'q' in filters:
+        term = f"%{filters['q']}%"
+        clauses.append("(s.first_name || ' ' || s.last_name LIKE ? OR s.index_number LIKE ? "
+                       "OR s.student_id LIKE ? OR s.email LIKE ?)")
+        params += [term] * 4
+    if 'college' in filters:
+        clauses.append('s.college_id = ?')
+        params.append(filters['college'])
+    if 'status' in filters:
+        clauses.append('s.status = ?')
+        params.append(filters['status'])
+    return ('WHERE ' + ' AND '.join(clauses)) if clauses else '', params, filters
+
+def attendance_filters(args):
+    """WHERE clause, params and active filters for the attendance reports"""
+    columns = {'date': 'es.exam_date', 'college': 'c.id', 'department': 'd.id', 'status': 'ea.status'}
+    filters = {key: args.get(key, '').strip() for key in columns}
+    filters = {key: value for key, value in filters.items() if value}
+    where = ' AND '.join(f'{columns[key]} = ?' for key in filters)
+    return ('WHERE ' + where) if where else '', list(filters.values()), filters
+
+def csv_response(filename, header, rows):
+    """Stream a header and rows (e.g. a live cursor) as a CSV download"""
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in itertools.chain([header], rows):
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
 @app.route('/admin/students')
 @login_required
 def admin_students():
     """Students management page"""
-    conn = get_db_connection()
-    students = conn.execute('''
+    page = max(request.args.get('page', 1, type=int), 1)
+    where, params, filters = student_filters(request.args)
+    conn = get_db()
+    # One extra row tells us whether a next page exists
+    students = conn.execute(f'''
         SELECT s.*, c.name as college_name, d.name as department_name,
                ay.year_code as academic_year
         FROM students s
         JOIN colleges c ON s.college_id = c.id
         JOIN departments d ON s.department_id = d.id
         JOIN academic_years ay ON s.academic_year_id = ay.id
+        {where}
         ORDER BY s.created_at DESC
-    ''').fetchall()
-    conn.close()
+        LIMIT ? OFFSET ?
+    ''', params + [ADMIN_PAGE_SIZE + 1, (page - 1) * ADMIN_PAGE_SIZE]).fetchall()
+    total_students = conn.execute(f'SELECT COUNT(*) FROM students s {where}', params).fetchone()[0]
+    colleges = conn.execute('SELECT id, name FROM colleges ORDER BY name').fetchall()
+    has_next = len(students) > ADMIN_PAGE_SIZE
     
-    return render_template('admin/students.html', students=students)
+    return render_template('admin/students.html', students=students[:ADMIN_PAGE_SIZE],
+                           total_students=total_students, colleges=colleges,
+                           filters=filters, page=page, has_next=has_next)
+
+@app.route('/admin/students/export')
+@login_required
+def admin_students_export():
+    """Download every student matching the current filters as CSV"""
+    where, params, _ = student_filters(request.args)
+    cursor = get_db().execute(f'''
+        SELECT s.student_id,
+               s.first_name || ' ' || COALESCE(s.middle_name || ' ', '') || s.last_name,
+               s.index_number, s.email, c.name, d.name, s.year_of_study,
+               ay.year_code, s.status, s.created_at
+        FROM students s
+        JOIN colleges c ON s.college_id = c.id
+        JOIN departments d ON s.department_id = d.id
+        JOIN academic_years ay ON s.academic_year_id = ay.id
+        {where}
+        ORDER BY s.created_at DESC
+    ''', params)
+    header = ['Student ID', 'Name', 'Index Number', 'Email', 'College', 'Department',
+              'Year of Study', 'Academic Year', 'Status', 'Registration Date']
+    return csv_response(f"students_export_{datetime.now().strftime('%Y-%m-%d')}.csv", header, cursor)
 
 @app.route('/admin/exam-sessions')
 @login_required
 def admin_exam_sessions():
     """Exam sessions management page"""
-    conn = get_db_connection()
+    conn = get_db()
     exam_sessions = conn.execute('''
         SELECT es.*, er.room_number, er.building, c.name as college_name, d.name as department_name
         FROM exam_sessions es
@@ -579,7 +1029,6 @@ def admin_exam_sessions():
     
     rooms = conn.execute('SELECT * FROM exam_rooms ORDER BY room_number').fetchall()
     colleges = conn.execute('SELECT * FROM colleges WHERE status = "active" ORDER BY name').fetchall()
-    conn.close()
     
     return render_template('admin/exam_sessions.html', 
                          exam_sessions=exam_sessions, 
@@ -592,7 +1041,7 @@ def admin_exam_sessions_create():
     """Create new exam session"""
     data = request.form
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         conn.execute('''
             INSERT INTO exam_sessions (
@@ -609,8 +1058,6 @@ def admin_exam_sessions_create():
         flash('Exam session created successfully!', 'success')
     except Exception as e:
         flash(f'Error creating exam session: {str(e)}', 'error')
-    finally:
-        conn.close()
     
     return redirect(url_for('admin_exam_sessions'))
 
@@ -618,7 +1065,7 @@ def admin_exam_sessions_create():
 @login_required
 def admin_index_assignments():
     """Index number range assignments page"""
-    conn = get_db_connection()
+    conn = get_db()
     
     assignments = conn.execute('''
         SELECT ira.*, er.room_number, er.building, es.title as exam_title,
@@ -640,7 +1087,6 @@ def admin_index_assignments():
     ''').fetchall()
     
     rooms = conn.execute('SELECT * FROM exam_rooms ORDER BY room_number').fetchall()
-    conn.close()
     
     return render_template('admin/index_assignments.html', 
                          assignments=assignments, 
@@ -653,7 +1099,7 @@ def admin_index_assignments_create():
     """Create new index number range assignment"""
     data = request.form
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         conn.execute('''
             INSERT INTO index_range_assignments (
@@ -669,8 +1115,6 @@ def admin_index_assignments_create():
         flash('Index range assignment created successfully!', 'success')
     except Exception as e:
         flash(f'Error creating assignment: {str(e)}', 'error')
-    finally:
-        conn.close()
     
     return redirect(url_for('admin_index_assignments'))
 
@@ -678,9 +1122,12 @@ def admin_index_assignments_create():
 @login_required
 def admin_attendance_reports():
     """Attendance reports page"""
-    conn = get_db_connection()
+    page = max(request.args.get('page', 1, type=int), 1)
+    where, params, filters = attendance_filters(request.args)
+    conn = get_db()
     
-    attendance = conn.execute('''
+    # One extra row tells us whether a next page exists
+    attendance = conn.execute(f'''
         SELECT ea.*, s.first_name, s.last_name, s.index_number,
                es.title as exam_title, es.exam_date, es.start_time,
                c.name as college_name, d.name as department_name
@@ -689,12 +1136,52 @@ def admin_attendance_reports():
         JOIN exam_sessions es ON ea.exam_session_id = es.id
         JOIN colleges c ON s.college_id = c.id
         JOIN departments d ON s.department_id = d.id
+        {where}
         ORDER BY ea.verification_time DESC
-    ''').fetchall()
+        LIMIT ? OFFSET ?
+    ''', params + [ADMIN_PAGE_SIZE + 1, (page - 1) * ADMIN_PAGE_SIZE]).fetchall()
+    has_next = len(attendance) > ADMIN_PAGE_SIZE
     
-    conn.close()
+    # Summary cards cover every matching record, not just this page
+    summary = conn.execute(f'''
+        SELECT COUNT(*) as total,
+               COALESCE(SUM(ea.status = 'present'), 0) as present,
+               COALESCE(SUM(ea.status = 'late'), 0) as late
+        FROM exam_attendance ea
+        JOIN students s ON ea.student_id = s.id
+        JOIN exam_sessions es ON ea.exam_session_id = es.id
+        JOIN colleges c ON s.college_id = c.id
+        JOIN departments d ON s.department_id = d.id
+        {where}
+    ''', params).fetchone()
+    colleges = conn.execute('SELECT id, name FROM colleges ORDER BY name').fetchall()
+    departments = conn.execute('SELECT id, name FROM departments ORDER BY name').fetchall()
     
-    return render_template('admin/attendance_reports.html', attendance=attendance)
+    return render_template('admin/attendance_reports.html', attendance=attendance[:ADMIN_PAGE_SIZE],
+                           summary=summary, colleges=colleges, departments=departments,
+                           filters=filters, page=page, has_next=has_next)
+
+@app.route('/admin/attendance-reports/export')
+@login_required
+def admin_attendance_export():
+    """Download every attendance record matching the current filters as CSV"""
+    where, params, _ = attendance_filters(request.args)
+    cursor = get_db().execute(f'''
+        SELECT ea.id, s.first_name || ' ' || s.last_name, s.index_number,
+               c.name, d.name, es.title, es.exam_date, ea.verification_time,
+               COALESCE(ea.room_assignment, 'Not Assigned'), ea.verification_method,
+               ea.confidence_score, ea.status
+        FROM exam_attendance ea
+        JOIN students s ON ea.student_id = s.id
+        JOIN exam_sessions es ON ea.exam_session_id = es.id
+        JOIN colleges c ON s.college_id = c.id
+        JOIN departments d ON s.department_id = d.id
+        {where}
+        ORDER BY ea.verification_time DESC
+    ''', params)
+    header = ['ID', 'Student Name', 'Index Number', 'College', 'Department', 'Exam Session',
+              'Date', 'Verification Time', 'Room Assignment', 'Method', 'Confidence', 'Status']
+    return csv_response(f"attendance_report_{datetime.now().strftime('%Y-%m-%d')}.csv", header, cursor)
 
 # ===============================
 # ADMIN API ENDPOINTS
@@ -704,7 +1191,7 @@ def admin_attendance_reports():
 @login_required
 def admin_student_details(student_id):
     """Get detailed student information via AJAX"""
-    conn = get_db_connection()
+    conn = get_db()
     student = conn.execute('''
         SELECT s.*, c.name as college_name, d.name as department_name,
                ay.year_code as academic_year,
@@ -721,33 +1208,30 @@ def admin_student_details(student_id):
     ''', (student_id,)).fetchone()
     
     if not student:
-        conn.close()
         return jsonify({'success': False, 'message': 'Student not found'})
     
     # Get recent recognition logs
-    recent_logs = conn.execute('''
+    recent_logs = fetch_dicts(conn, '''
         SELECT * FROM recognition_logs 
         WHERE student_id = ? 
         ORDER BY created_at DESC 
         LIMIT 10
-    ''', (student_id,)).fetchall()
+    ''', (student_id,))
     
     # Get exam attendance
-    attendance = conn.execute('''
+    attendance = fetch_dicts(conn, '''
         SELECT ea.*, es.title as exam_title, es.exam_date
         FROM exam_attendance ea
         JOIN exam_sessions es ON ea.exam_session_id = es.id
         WHERE ea.student_id = ?
         ORDER BY ea.verification_time DESC
-    ''', (student_id,)).fetchall()
-    
-    conn.close()
+    ''', (student_id,))
     
     return jsonify({
         'success': True,
         'student': dict(student),
-        'recent_logs': [dict(log) for log in recent_logs],
-        'attendance': [dict(att) for att in attendance]
+        'recent_logs': recent_logs,
+        'attendance': attendance
     })
 
 @app.route('/admin/api/students/<int:student_id>/toggle-status', methods=['POST'])
@@ -760,13 +1244,14 @@ def admin_toggle_student_status(student_id):
     if new_status not in ['active', 'inactive']:
         return jsonify({'success': False, 'message': 'Invalid status'})
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         conn.execute(
-            'UPDATE students SET status = ?, updated_at = ? WHERE id = ?',
-            (new_status, datetime.now(), student_id)
+            "UPDATE students SET status = ?, updated_at = datetime('now', 'localtime') WHERE id = ?",
+            (new_status, student_id)
         )
         conn.commit()
+        invalidate_encoding_cache()
         
         return jsonify({
             'success': True,
@@ -775,8 +1260,6 @@ def admin_toggle_student_status(student_id):
         })
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error updating status: {str(e)}'})
-    finally:
-        conn.close()
 
 @app.route('/admin/api/students/<int:student_id>', methods=['PUT'])
 @login_required
@@ -784,46 +1267,44 @@ def admin_edit_student(student_id):
     """Edit student information"""
     data = request.json
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # Update student information
         conn.execute('''
             UPDATE students SET
                 first_name = ?, middle_name = ?, last_name = ?,
                 email = ?, phone = ?, year_of_study = ?,
-                updated_at = ?
+                updated_at = datetime('now', 'localtime')
             WHERE id = ?
         ''', (
             data.get('first_name'), data.get('middle_name', ''), data.get('last_name'),
             data.get('email'), data.get('phone', ''), data.get('year_of_study'),
-            datetime.now(), student_id
+            student_id
         ))
         conn.commit()
+        invalidate_encoding_cache()
         
         return jsonify({'success': True, 'message': 'Student updated successfully'})
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error updating student: {str(e)}'})
-    finally:
-        conn.close()
 
 @app.route('/admin/api/students/<int:student_id>', methods=['DELETE'])
 @login_required
 def admin_delete_student(student_id):
     """Delete student (soft delete)"""
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # Soft delete by setting status to 'deleted'
         conn.execute(
-            'UPDATE students SET status = ?, updated_at = ? WHERE id = ?',
-            ('deleted', datetime.now(), student_id)
+            "UPDATE students SET status = ?, updated_at = datetime('now', 'localtime') WHERE id = ?",
+            ('deleted', student_id)
         )
         conn.commit()
+        invalidate_encoding_cache()
         
         return jsonify({'success': True, 'message': 'Student deleted successfully'})
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error deleting student: {str(e)}'})
-    finally:
-        conn.close()
 
 @app.route('/admin/api/colleges/<int:college_id>/toggle-status', methods=['POST'])
 @login_required
@@ -835,7 +1316,7 @@ def admin_toggle_college_status(college_id):
     if new_status not in ['active', 'inactive']:
         return jsonify({'success': False, 'message': 'Invalid status'})
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         conn.execute(
             'UPDATE colleges SET status = ? WHERE id = ?',
@@ -850,14 +1331,12 @@ def admin_toggle_college_status(college_id):
         })
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error updating status: {str(e)}'})
-    finally:
-        conn.close()
 
 @app.route('/admin/api/colleges/<int:college_id>', methods=['DELETE'])
 @login_required
 def admin_delete_college(college_id):
     """Delete college (soft delete)"""
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # Check if college has students
         student_count = conn.execute(
@@ -893,14 +1372,12 @@ def admin_delete_college(college_id):
         return jsonify({'success': True, 'message': 'College deleted successfully'})
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error deleting college: {str(e)}'})
-    finally:
-        conn.close()
 
 @app.route('/admin/api/departments/<int:department_id>')
 @login_required
 def admin_department_details(department_id):
     """Get department details via AJAX"""
-    conn = get_db_connection()
+    conn = get_db()
     department = conn.execute('''
         SELECT d.*, c.name as college_name
         FROM departments d
@@ -909,10 +1386,8 @@ def admin_department_details(department_id):
     ''', (department_id,)).fetchone()
     
     if not department:
-        conn.close()
         return jsonify({'success': False, 'message': 'Department not found'})
     
-    conn.close()
     return jsonify({
         'success': True,
         'department': dict(department)
@@ -928,7 +1403,7 @@ def admin_toggle_department_status(department_id):
     if new_status not in ['active', 'inactive']:
         return jsonify({'success': False, 'message': 'Invalid status'})
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         conn.execute(
             'UPDATE departments SET status = ? WHERE id = ?',
@@ -943,8 +1418,6 @@ def admin_toggle_department_status(department_id):
         })
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error updating status: {str(e)}'})
-    finally:
-        conn.close()
 
 @app.route('/admin/api/departments/<int:department_id>', methods=['PUT'])
 @login_required
@@ -952,7 +1425,7 @@ def admin_edit_department(department_id):
     """Edit department information"""
     data = request.json
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         conn.execute('''
             UPDATE departments SET
@@ -967,14 +1440,12 @@ def admin_edit_department(department_id):
         return jsonify({'success': True, 'message': 'Department updated successfully'})
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error updating department: {str(e)}'})
-    finally:
-        conn.close()
 
 @app.route('/admin/api/departments/<int:department_id>', methods=['DELETE'])
 @login_required
 def admin_delete_department(department_id):
     """Delete department (soft delete)"""
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # Check if department has students
         student_count = conn.execute(
@@ -998,14 +1469,12 @@ def admin_delete_department(department_id):
         return jsonify({'success': True, 'message': 'Department deleted successfully'})
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error deleting department: {str(e)}'})
-    finally:
-        conn.close()
 
 @app.route('/admin/api/exam-sessions/<int:session_id>/activate', methods=['POST'])
 @login_required
 def admin_activate_exam_session(session_id):
     """Activate an exam session"""
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # First, deactivate all other sessions for the same date
         session_info = conn.execute(
@@ -1031,14 +1500,12 @@ def admin_activate_exam_session(session_id):
         return jsonify({'success': True, 'message': 'Exam session activated successfully'})
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error activating session: {str(e)}'})
-    finally:
-        conn.close()
 
 @app.route('/admin/api/exam-sessions/<int:session_id>')
 @login_required
 def admin_exam_session_details(session_id):
     """Get exam session details via AJAX"""
-    conn = get_db_connection()
+    conn = get_db()
     session = conn.execute('''
         SELECT es.*, er.room_number, er.building, c.name as college_name, d.name as department_name
         FROM exam_sessions es
@@ -1049,10 +1516,8 @@ def admin_exam_session_details(session_id):
     ''', (session_id,)).fetchone()
     
     if not session:
-        conn.close()
         return jsonify({'success': False, 'message': 'Exam session not found'})
     
-    conn.close()
     return jsonify({
         'success': True,
         'session': dict(session)
@@ -1064,7 +1529,7 @@ def admin_edit_exam_session(session_id):
     """Edit exam session information"""
     data = request.json
     
-    conn = get_db_connection()
+    conn = get_db()
     try:
         conn.execute('''
             UPDATE exam_sessions SET
@@ -1080,14 +1545,12 @@ def admin_edit_exam_session(session_id):
         return jsonify({'success': True, 'message': 'Exam session updated successfully'})
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error updating exam session: {str(e)}'})
-    finally:
-        conn.close()
 
 @app.route('/admin/api/exam-sessions/<int:session_id>', methods=['DELETE'])
 @login_required
 def admin_delete_exam_session(session_id):
     """Delete exam session"""
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # Check if session has attendance records
         attendance_count = conn.execute(
@@ -1108,12 +1571,11 @@ def admin_delete_exam_session(session_id):
         return jsonify({'success': True, 'message': 'Exam session deleted successfully'})
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error deleting exam session: {str(e)}'})
-    finally:
-        conn.close()
 
 if __name__ == '__main__':
     # Initialize database
     init_enhanced_db()
+    migrate_database()
     
     # Run the application
     app.run(host='0.0.0.0', port=5002, debug=True)
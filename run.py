@@ -6,21 +6,27 @@ Execute this script to start the application
 import subprocess
 import sys
 import os
+from importlib.util import find_spec
+
+# Distribution name -> import name; they differ for OpenCV and Pillow
+REQUIRED_PACKAGES = {
+    'flask': 'flask',
+    'opencv-python': 'cv2',
+    'face-recognition': 'face_recognition',
+    'numpy': 'numpy',
+    'pillow': 'PIL',
+    'werkzeug': 'werkzeug',
+}
 
 def check_dependencies():
     """Check if all required packages are installed"""
-    required_packages = [
-        'flask', 'opencv-python', 'face-recognition', 
-        'numpy', 'pillow', 'werkzeug'
+    # find_spec only locates each module, so dlib/OpenCV/NumPy aren't
+    # loaded just to be checked
+    missing_packages = [
+        package for package, module in REQUIRED_PACKAGES.items()
+        if find_spec(module) is None
     ]
     
-    missing_packages = []
-    for package in required_packages:
-        try:
-            __import__(package.replace('-', '_'))
-        except ImportError:
-            missing_packages.append(package)
-    
     if missing_packages:
         print(f"Missing packages: {', '.join(missing_packages)}")
         print("Please run: pip install -r requirements.txt")
@@ -34,7 +40,8 @@ def main():
     print("=" * 50)
     
     # Check if we're in the right directory
-    if not os.path.exists('app.py'):
+    entries = {entry.name for entry in os.scandir('.')}
+    if 'app.py' not in entries:
         print("Error: app.py not found. Please run this script from the project root directory.")
         sys.exit(1)
     
@@ -48,10 +55,17 @@ def main():
     print("-" * 50)
     
     # Run the Flask application
-    try:
-        subprocess.run([sys.executable, 'app.py'])
-    except KeyboardInterrupt:
-        print("\nServer stopped.")
+    if os.name == 'nt':
+        # execv on Windows spawns a detached child instead of replacing this process
+        try:
+            subprocess.run([sys.executable, 'app.py'])
+        except KeyboardInterrupt:
+            print("\nServer stopped.")
+    else:
+        # Replace this interpreter with the app instead of keeping a second one
+        # resident; the app then receives Ctrl+C directly
+        sys.stdout.flush()
+        os.execv(sys.executable, [sys.executable, os.path.abspath('app.py')])
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -6,8 +6,33 @@ This script helps you configure email services for OTP and notifications.
 
 import os
 import sys
+import json
+import argparse
 import getpass
-from email_service import EmailService, get_email_service_examples
+
+# Fields prompted for and saved to .env, per provider:
+# (config key, prompt, secret input, .env variable, parser for the typed text)
+PROVIDER_SPEC = {
+    'gmail': [
+        ('username', "Gmail address: ", False, 'GMAIL_USERNAME', None),
+        ('password', "App Password (16 characters): ", True, 'GMAIL_APP_PASSWORD', None),
+    ],
+    'outlook': [
+        ('username', "Outlook email: ", False, 'OUTLOOK_USERNAME', None),
+        ('password', "Password: ", True, 'OUTLOOK_PASSWORD', None),
+    ],
+    'yahoo': [
+        ('username', "Yahoo email: ", False, 'YAHOO_USERNAME', None),
+        ('password', "App Password: ", True, 'YAHOO_PASSWORD', None),
+    ],
+    'custom': [
+        ('smtp_server', "SMTP Server: ", False, 'SMTP_SERVER', None),
+        ('smtp_port', "SMTP Port (default 587): ", False, 'SMTP_PORT', lambda v: int(v or "587")),
+        ('use_tls', "Use TLS? (y/n, default y): ", False, 'SMTP_USE_TLS', lambda v: v.lower() != 'n'),
+        ('username', "Email/Username: ", False, 'SMTP_USERNAME', None),
+        ('password', "Password: ", True, 'SMTP_PASSWORD', None),
+    ],
+}
 
 def print_header():
     print("=" * 60)
@@ -15,18 +40,17 @@ def print_header():
     print("=" * 60)
     print()
 
-def print_provider_info():
+def print_provider_info(examples):
     print("📋 Available Email Providers:")
     print()
-    examples = get_email_service_examples()
     
     for i, (provider, config) in enumerate(examples.items(), 1):
         print(f"{i}. {provider.upper()}")
         print(f"   Description: {config['description']}")
         print()
 
-def choose_provider():
-    providers = list(get_email_service_examples().keys())
+def choose_provider(examples):
+    providers = list(examples.keys())
     
     while True:
         try:
@@ -39,10 +63,9 @@ def choose_provider():
         except ValueError:
             print("Please enter a valid number")
 
-def get_provider_config(provider):
+def get_provider_config(provider, examples):
     """Get configuration for the selected provider"""
     config = {}
-    examples = get_email_service_examples()
     
     print(f"\n🔧 Configuring {provider.upper()}")
     print("-" * 40)
@@ -53,35 +76,22 @@ def get_provider_config(provider):
         print(f"  {instruction}")
     print()
     
-    if provider == 'gmail':
-        config['username'] = input("Gmail address: ").strip()
-        config['password'] = getpass.getpass("App Password (16 characters): ").strip()
-        
-    elif provider == 'outlook':
-        config['username'] = input("Outlook email: ").strip()
-        config['password'] = getpass.getpass("Password: ").strip()
-        
-    elif provider == 'yahoo':
-        config['username'] = input("Yahoo email: ").strip()
-        config['password'] = getpass.getpass("App Password: ").strip()
-        
-    elif provider == 'custom':
-        config['smtp_server'] = input("SMTP Server: ").strip()
-        config['smtp_port'] = int(input("SMTP Port (default 587): ").strip() or "587")
-        config['use_tls'] = input("Use TLS? (y/n, default y): ").strip().lower() != 'n'
-        config['username'] = input("Email/Username: ").strip()
-        config['password'] = getpass.getpass("Password: ").strip()
+    for field, prompt, secret, _, parse in PROVIDER_SPEC[provider]:
+        value = (getpass.getpass if secret else input)(prompt).strip()
+        config[field] = parse(value) if parse else value
     
     return config
 
-def test_email_service(provider, config):
+def test_email_service(provider, config, test_email=None):
     """Test the email service configuration"""
     print(f"\n🧪 Testing {provider} configuration...")
     
     try:
+        from email_service import EmailService
         email_service = EmailService(provider=provider, **config)
         
-        test_email = input("Enter a test email address (or press Enter to skip): ").strip()
+        if test_email is None:
+            test_email = input("Enter a test email address (or press Enter to skip): ").strip()
         if test_email:
             print("Sending test email...")
             success = email_service.send_otp_email(test_email, "123456", "testing")
@@ -100,93 +110,125 @@ def test_email_service(provider, config):
         print(f"❌ Configuration test failed: {str(e)}")
         return False
 
-def save_configuration(provider, config):
+def save_configuration(provider, config, entries):
     """Save configuration to environment file"""
     env_file = '.env'
     env_lines = []
     
     # Read existing .env file if it exists
-    if os.path.exists(env_file):
+    if env_file in entries:
         with open(env_file, 'r') as f:
-            env_lines = f.readlines()
-    
-    # Update or add email configuration
-    new_lines = []
-    email_vars_added = set()
-    
-    # Add provider setting
-    provider_line = f"EMAIL_PROVIDER={provider}\n"
+            env_lines = f.read().splitlines()
     
+    # Parse once into KEY -> value, remembering the original line order;
+    # comments and blank lines are carried through untouched
+    existing = {}
+    order = []
     for line in env_lines:
-        if line.startswith('EMAIL_PROVIDER='):
-            new_lines.append(provider_line)
-        elif line.startswith(f'{provider.upper()}_'):
-            # Skip existing provider config lines, we'll add new ones
-            continue
+        key, sep, value = line.partition('=')
+        key = key.strip()
+        if sep and key and not key.startswith('#'):
+            if key not in existing:
+                order.append((key, None))
+            existing[key] = value
         else:
-            new_lines.append(line)
-    
-    # If EMAIL_PROVIDER wasn't in the file, add it
-    if not any(line.startswith('EMAIL_PROVIDER=') for line in env_lines):
-        new_lines.append(provider_line)
-    
-    # Add provider-specific configuration
-    if provider == 'gmail':
-        new_lines.append(f"GMAIL_USERNAME={config['username']}\n")
-        new_lines.append(f"GMAIL_APP_PASSWORD={config['password']}\n")
-    elif provider == 'outlook':
-        new_lines.append(f"OUTLOOK_USERNAME={config['username']}\n")
-        new_lines.append(f"OUTLOOK_PASSWORD={config['password']}\n")
-    elif provider == 'yahoo':
-        new_lines.append(f"YAHOO_USERNAME={config['username']}\n")
-        new_lines.append(f"YAHOO_PASSWORD={config['password']}\n")
-    elif provider == 'custom':
-        new_lines.append(f"SMTP_SERVER={config['smtp_server']}\n")
-        new_lines.append(f"SMTP_PORT={config['smtp_port']}\n")
-        new_lines.append(f"SMTP_USERNAME={config['username']}\n")
-        new_lines.append(f"SMTP_PASSWORD={config['password']}\n")
-        new_lines.append(f"SMTP_USE_TLS={str(config['use_tls']).lower()}\n")
-    
-    # Write updated configuration
-    with open(env_file, 'w') as f:
-        f.writelines(new_lines)
+            order.append((None, line))
+    
+    # Merge the new email configuration over whatever was there
+    new_keys = {'EMAIL_PROVIDER': provider}
+    for field, _, _, env_var, _ in PROVIDER_SPEC[provider]:
+        value = config[field]
+        new_keys[env_var] = str(value).lower() if isinstance(value, bool) else value
+    order.extend((key, None) for key in new_keys if key not in existing)
+    existing.update(new_keys)
+    
+    content = '\n'.join(f"{key}={existing[key]}" if key else line
+                        for key, line in order) + '\n'
+    
+    # Write to a temp file and rename over .env so an interrupted save
+    # never leaves it half-written
+    tmp_file = env_file + '.tmp'
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)  # Left over from an interrupted save, possibly with looser permissions
+    # .env holds the SMTP password, so keep it owner-only (0600)
+    fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(content)
+    os.replace(tmp_file, env_file)
     
     print(f"✅ Configuration saved to {env_file}")
 
+def print_next_steps():
+    print("\n🎉 Email service setup completed successfully!")
+    print("\nNext steps:")
+    print("1. Restart your application to load the new configuration")
+    print("2. Test OTP functionality during user registration")
+    print("3. Check application logs for any email-related issues")
+
 def main():
+    parser = argparse.ArgumentParser(description="Configure the SFRS email service")
+    parser.add_argument('--config-file',
+                        help="JSON file with 'provider', its fields and an optional "
+                             "'test_email'; skips all prompts")
+    parser.add_argument('--skip-test', action='store_true',
+                        help="Save without sending a test email")
+    args = parser.parse_args()
+    
     print_header()
     
+    # One directory listing answers every file-existence check below
+    entries = {entry.name for entry in os.scandir('.')}
+    
     # Check if .env template exists
-    if not os.path.exists('.env.template'):
+    if '.env.template' not in entries:
         print("⚠️  Warning: .env.template not found")
         print("   This script works best with the template file")
         print()
     
-    print_provider_info()
+    # Scripted setup: no prompts, and no SMTP round-trip with --skip-test
+    if args.config_file:
+        with open(args.config_file) as f:
+            config = json.load(f)
+        provider = config.pop('provider', None)
+        if provider not in PROVIDER_SPEC:
+            parser.error(f"provider must be one of: {', '.join(PROVIDER_SPEC)}")
+        test_email = config.pop('test_email', '')
+        
+        if args.skip_test or test_email_service(provider, config, test_email):
+            save_configuration(provider, config, entries)
+            print_next_steps()
+        else:
+            print("\n❌ Setup failed. Please check your configuration and try again.")
+            sys.exit(1)
+        return
     
-    # Choose provider
-    provider = choose_provider()
+    # Imported on first use so --help or an early Ctrl+C skips the email stack;
+    # the examples are built once and shared by every step below
+    from email_service import get_email_service_examples
+    examples = get_email_service_examples()
     
-    # Get configuration
-    config = get_provider_config(provider)
+    print_provider_info(examples)
     
-    # Test configuration
-    if test_email_service(provider, config):
-        # Save configuration
-        save_configuration(provider, config)
+    # Retry in place so the header, listing and examples are done only once
+    while True:
+        # Choose provider
+        provider = choose_provider(examples)
+        
+        # Get configuration
+        config = get_provider_config(provider, examples)
         
-        print("\n🎉 Email service setup completed successfully!")
-        print("\nNext steps:")
-        print("1. Restart your application to load the new configuration")
-        print("2. Test OTP functionality during user registration")
-        print("3. Check application logs for any email-related issues")
+        # Test configuration
+        if test_email_service(provider, config):
+            # Save configuration
+            save_configuration(provider, config, entries)
+            print_next_steps()
+            break
         
-    else:
         print("\n❌ Setup failed. Please check your configuration and try again.")
         
         retry = input("\nWould you like to try again? (y/n): ").strip().lower()
-        if retry == 'y':
-            main()
+        if retry != 'y':
+            break
 
 if __name__ == '__main__':
     try:
@@ -6,10 +6,18 @@ Tests the complete email integration with the enhanced app.
 
 import os
 import sys
-from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+def _load_env(path='.env'):
+    """Read the plain KEY=VALUE lines setup_email writes, without python-dotenv"""
+    try:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#') and '=' in line:
+                    key, value = line.split('=', 1)
+                    os.environ.setdefault(key.strip(), value.strip())
+    except FileNotFoundError:
+        pass
 
 def test_email_integration():
     """Test email integration with the enhanced app"""
@@ -18,15 +26,12 @@ def test_email_integration():
     print("=" * 50)
     
     try:
-        from email_service import EmailService
-        
-        # Test Gmail configuration
-        print("\n1️⃣  Testing Gmail Configuration...")
-        gmail_service = EmailService(provider='gmail')
-        print("   ✅ Gmail service initialized successfully")
+        # Load environment variables
+        _load_env()
         
-        # Test environment variables
-        print("\n2️⃣  Testing Environment Variables...")
+        # Test environment variables first so a missing .env fails fast,
+        # before the email stack is imported or a service is built
+        print("\n1️⃣  Testing Environment Variables...")
         gmail_user = os.getenv('GMAIL_USERNAME')
         gmail_pass = os.getenv('GMAIL_APP_PASSWORD')
         email_provider = os.getenv('EMAIL_PROVIDER')
@@ -40,6 +45,12 @@ def test_email_integration():
         else:
             print("   ❌ Missing required environment variables")
             return False
+        
+        # Test Gmail configuration
+        print("\n2️⃣  Testing Gmail Configuration...")
+        from email_service import EmailService
+        gmail_service = EmailService(provider='gmail')
+        print("   ✅ Gmail service initialized successfully")
             
         # Test OTP email
         print("\n3️⃣  Testing OTP Email...")
@@ -58,7 +69,8 @@ def test_email_integration():
             print(f"   ❌ Failed to send OTP email to {test_email}")
             return False
             
-        # Test welcome email
+        # Test welcome email; this reuses the pooled session the OTP email
+        # just authenticated, so there is no second connect/TLS/login
         print("\n4️⃣  Testing Welcome Email...")
         result = gmail_service.send_welcome_email(
             to_email=test_email,
@@ -70,6 +82,9 @@ def test_email_integration():
             print(f"   ✅ Welcome email sent successfully to {test_email}")
         else:
             print(f"   ❌ Failed to send welcome email to {test_email}")
+        
+        # QUIT the shared session now rather than at interpreter exit
+        gmail_service.close()
             
         print("\n✅ Email integration test completed successfully!")
         print(f"📬 Check your inbox at {test_email} for test emails")